@@ -1,5 +1,4 @@
 import os
-import requests
 import time
 from dotenv import load_dotenv
 from typing import List
@@ -7,16 +6,16 @@ from sqlalchemy.orm import Session
 from models import Lead
 from database import SessionLocal, LeadDB
 from apollo import enrich_lead_with_apollo
+from ghl_client import ghl
 
 load_dotenv()
 
-GoHighLevel_key = os.getenv("GOHIGHLEVEL_KEY")
 Location_ID = os.getenv("GOHIGHLEVEL_LOCATION_ID")
 
 def fetch_gohighlevel_leads(desired_count: int = 20, per_page: int = 20) -> List[Lead]:
-    url = "https://services.leadconnectorhq.com/contacts/"
+    url = "/contacts/"
+    # Auth comes from the shared client (ghl_client.py)
     headers = {
-        "Authorization": f"Bearer {GoHighLevel_key}",
         "Version": "2021-07-28",
         "Content-Type": "application/json"
     }
@@ -35,11 +34,12 @@ def fetch_gohighlevel_leads(desired_count: int = 20, per_page: int = 20) -> List
             "page": page
         }
 
+        response = None
         try:
-            response = requests.get(url, headers=headers, params=params)
+            response = ghl.request_sync("GET", url, location_id=Location_ID, headers=headers, params=params)
             response.raise_for_status()
         except Exception as e:
-            print("GHL API error:", response.status_code, response.text)
+            print("GHL API error:", response.status_code if response is not None else e, response.text if response is not None else "")
             time.sleep(2)
             attempts += 1
             continue
@@ -1,7 +1,16 @@
+from typing import Optional
 from celery_worker import celery_app
 from pagespeed import test_all_unspeeded_leads
+from job_ledger import start_job, resume_job
 
-@celery_app.task
-def run_bulk_speedtest_task():
-    count = test_all_unspeeded_leads()
-    return {"message": f"Tested {count} websites"}
+@celery_app.task(bind=True)
+def run_bulk_speedtest_task(self, resume_job_id: Optional[str] = None):
+    if resume_job_id:
+        if not resume_job(resume_job_id):
+            return {"error": f"Job {resume_job_id} not found"}
+        job_id = resume_job_id
+    else:
+        job_id = self.request.id
+        start_job(job_id, "speedtest")
+    count = test_all_unspeeded_leads(job_id=job_id, resume=bool(resume_job_id))
+    return {"job_id": job_id, "message": f"Tested {count} websites"}
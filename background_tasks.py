@@ -1,8 +1,20 @@
-from celery_worker import celery_app
+import os
+import datetime
+from typing import List, Optional
+from celery import chain, group
+from celery_worker import celery_app, INTERACTIVE_QUEUE
 from pagespeed import refresh_speed_for_lead
 from database import SessionLocal, LeadDB
-from scraping import scrape_and_extract
-from punchline import generate_punchlines
+from scraping import scrape_and_extract, pick_evidence, evidence_fingerprint
+from punchline import generate_punchlines, FALLBACK_LINE
+from punchline_index import get_punchline_index
+from job_progress import add_total, finish_dispatch
+from job_ledger import start_job, resume_job, checkpoint, mark_dispatched, record_outcome, exclude_handled
+from worker_runtime import runtime
+
+FIRECRAWL_BASE = os.getenv("FIRECRAWL_BASE", "https://api.firecrawl.dev")
+FIRECRAWL_KEY = os.getenv("FIRECRAWL_KEY", "fc-135574cccbe141b5bcfe6c1a40d17cb9")
+BULK_CHUNK_SIZE = int(os.getenv("BULK_CHUNK_SIZE", "200"))
 
 @celery_app.task
 def run_speed_test(lead_id: int):
@@ -12,62 +24,152 @@ def run_speed_test(lead_id: int):
     print(f"[Celery] Updated lead {lead_id}: web={web}, mob={mob}")
     return {"message": f"Updated: W-{web}, M-{mob}"}
 
+# -------------------------
+# Stage bodies
+# -------------------------
+async def _scrape_with_pooled_resources(url: str):
+    return await scrape_and_extract(
+        url,
+        firecrawl_base=FIRECRAWL_BASE,
+        firecrawl_key=FIRECRAWL_KEY,
+        http_client=await runtime.get_http_client(),
+        get_browser=runtime.get_browser,
+    )
+
+def _scrape_evidence(db, lead: LeadDB) -> int:
+    """Scrape the lead's site and persist pick_evidence() output on the row. Returns the item count."""
+    pages, signals, used = runtime.run(_scrape_with_pooled_resources(lead.website_url))
+    evidence = pick_evidence(signals)
+    lead.punchline_evidence = [list(item) for item in evidence]
+    db.commit()
+    return len(evidence)
+
+def _generate_from_evidence(db, lead: LeadDB) -> None:
+    """Generate and save punchlines from the evidence persisted by the scrape stage."""
+    company = lead.company if lead.company else "Unknown"
+    index = get_punchline_index(skip_lines=[FALLBACK_LINE])
+    ranked_punchlines = generate_punchlines(company, lead.punchline_evidence, dedupe_index=index, lead_id=lead.id)
+    lead.punchline1 = ranked_punchlines[0]["line"] if len(ranked_punchlines) > 0 else None
+    lead.punchline2 = ranked_punchlines[1]["line"] if len(ranked_punchlines) > 1 else None
+    lead.punchline3 = ranked_punchlines[2]["line"] if len(ranked_punchlines) > 2 else None
+    lead.evidence_fingerprint = evidence_fingerprint(lead.punchline_evidence)
+    lead.punchlines_generated_at = datetime.datetime.utcnow()
+    db.commit()
+    index.replace_lead(lead.id, [None if p == FALLBACK_LINE else p for p in (lead.punchline1, lead.punchline2, lead.punchline3)])
+
+# -------------------------
+# Tasks (routed to the "scrape" and "llm" queues, see celery_worker.py)
+# -------------------------
 @celery_app.task
-def process_punchlines_for_lead(lead_id: int):
+def scrape_evidence_for_lead(lead_id: int):
     db = SessionLocal()
-    lead = db.query(LeadDB).filter(LeadDB.id == lead_id).first()
-    if not lead or not lead.website_url:
-        db.close()
-        return {"error": "Lead not found or missing website_url"}
     try:
-        # Scrape and extract signals
-        import asyncio
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        pages, signals, evidence = loop.run_until_complete(
-            scrape_and_extract(lead.website_url, firecrawl_base="https://api.firecrawl.dev", firecrawl_key="fc-135574cccbe141b5bcfe6c1a40d17cb9")
-        )
-        if not evidence:
-            db.close()
-            return {"error": "No evidence found"}
-        company = lead.company if lead.company else "Unknown"
-        ranked_punchlines = generate_punchlines(company, evidence)
-        lead.punchline1 = ranked_punchlines[0]["line"] if len(ranked_punchlines) > 0 else None
-        lead.punchline2 = ranked_punchlines[1]["line"] if len(ranked_punchlines) > 1 else None
-        lead.punchline3 = ranked_punchlines[2]["line"] if len(ranked_punchlines) > 2 else None
-        db.commit()
+        lead = db.query(LeadDB).filter(LeadDB.id == lead_id).first()
+        if not lead or not lead.website_url:
+            return {"lead_id": lead_id, "error": "Lead not found or missing website_url"}
+        count = _scrape_evidence(db, lead)
+        if not count:
+            return {"lead_id": lead_id, "error": "No evidence found"}
+        # Only the reference travels to the LLM stage; evidence stays on the lead row
+        return {"lead_id": lead_id, "evidence_items": count}
+    except Exception as e:
+        db.rollback()
+        return {"lead_id": lead_id, "error": str(e)}
+    finally:
         db.close()
-        return {"lead_id": lead_id, "status": "success"}
+
+@celery_app.task
+def generate_punchlines_for_lead(scrape_result: dict, job_id: Optional[str] = None, force: bool = True):
+    lead_id = scrape_result.get("lead_id")
+    if "error" in scrape_result:
+        record_outcome(job_id, lead_id, "failed", scrape_result["error"])
+        return scrape_result
+    db = SessionLocal()
+    try:
+        lead = db.query(LeadDB).filter(LeadDB.id == lead_id).first()
+        if not lead or not lead.punchline_evidence:
+            result = {"lead_id": lead_id, "error": "No stored evidence for lead"}
+        elif not force and lead.punchline1 and lead.evidence_fingerprint == evidence_fingerprint(lead.punchline_evidence):
+            # Same evidence as the last generation: keep the punchlines and save the LLM calls
+            result = {"lead_id": lead_id, "status": "skipped"}
+        else:
+            _generate_from_evidence(db, lead)
+            result = {"lead_id": lead_id, "status": "success"}
     except Exception as e:
+        db.rollback()
+        result = {"lead_id": lead_id, "error": str(e)}
+    finally:
         db.close()
-        return {"error": str(e)}
+    if "error" in result:
+        record_outcome(job_id, lead_id, "failed", result["error"])
+    elif result["status"] == "skipped":
+        record_outcome(job_id, lead_id, "skipped")
+    else:
+        record_outcome(job_id, lead_id, "processed")
+    return result
 
 @celery_app.task
-def process_punchlines_for_all_leads():
+def record_pipeline_failure(request, exc, traceback, lead_id: int, job_id: Optional[str] = None):
+    """link_error callback: a stage raised, so the chain stopped before recording the lead's outcome."""
+    print(f"[Celery] Punchline pipeline for lead {lead_id} failed in {request.task}: {exc!r}")
+    record_outcome(job_id, lead_id, "failed", f"{type(exc).__name__}: {exc}")
+
+def punchline_pipeline(lead_id: int, job_id: Optional[str] = None, force: bool = True, interactive: bool = False):
+    """
+    Scrape -> LLM chain for one lead. The AsyncResult of apply_async() tracks the final stage.
+    interactive=True sends both stages to the reserved interactive queue instead of "scrape"/"llm".
+    In a bulk job, an exception in either stage still records a "failed" outcome so the job can finish.
+    """
+    scrape = scrape_evidence_for_lead.s(lead_id)
+    generate = generate_punchlines_for_lead.s(job_id=job_id, force=force)
+    if interactive:
+        scrape.set(queue=INTERACTIVE_QUEUE)
+        generate.set(queue=INTERACTIVE_QUEUE)
+    pipeline = chain(scrape, generate)
+    if job_id:
+        pipeline.on_error(record_pipeline_failure.s(lead_id=lead_id, job_id=job_id))
+    return pipeline
+
+def _dispatch_chunk(job_id: str, lead_ids: List[int], force: bool) -> int:
+    add_total(job_id, len(lead_ids))
+    group(punchline_pipeline(lead_id, job_id=job_id, force=force) for lead_id in lead_ids).apply_async()
+    return len(lead_ids)
+
+@celery_app.task(bind=True)
+def process_punchlines_for_all_leads(self, force: bool = False, chunk_size: int = BULK_CHUNK_SIZE, resume_job_id: Optional[str] = None):
+    """
+    Stream lead ids and fan out one pipeline per lead; progress is tracked under the job id
+    (this task's id, or resume_job_id when continuing a ledgered run from its checkpoint).
+    Unless force is set, leads whose evidence fingerprint is unchanged keep their punchlines.
+    """
+    if resume_job_id:
+        if not resume_job(resume_job_id):
+            return {"error": f"Job {resume_job_id} not found"}
+        job_id = resume_job_id
+    else:
+        job_id = self.request.id
+        start_job(job_id, "punchlines", {"force": force})
+    dispatched = 0
     db = SessionLocal()
-    leads = db.query(LeadDB).filter(LeadDB.website_url != None).all()
-    processed = 0
-    errors = []
-    import asyncio
-    loop = asyncio.new_event_loop()
-    asyncio.set_event_loop(loop)
-    for lead in leads:
-        try:
-            pages, signals, evidence = loop.run_until_complete(
-                scrape_and_extract(lead.website_url, firecrawl_base="https://api.firecrawl.dev", firecrawl_key="fc-135574cccbe141b5bcfe6c1a40d17cb9")
-            )
-            if not evidence:
-                errors.append({"lead_id": lead.id, "reason": "No evidence found"})
-                continue
-            company = lead.company if lead.company else "Unknown"
-            ranked_punchlines = generate_punchlines(company, evidence)
-            lead.punchline1 = ranked_punchlines[0]["line"] if len(ranked_punchlines) > 0 else None
-            lead.punchline2 = ranked_punchlines[1]["line"] if len(ranked_punchlines) > 1 else None
-            lead.punchline3 = ranked_punchlines[2]["line"] if len(ranked_punchlines) > 2 else None
-            db.commit()  # Commit after each lead
-            processed += 1
-        except Exception as e:
-            db.rollback()  # Rollback on error
-            errors.append({"lead_id": lead.id, "reason": str(e)})
-    db.close()
-    return {"processed": processed, "errors": errors}
+    try:
+        query = db.query(LeadDB.id).filter(LeadDB.website_url != None)
+        # On resume, anything with a recorded outcome is done; dispatched-but-lost leads go out again
+        lead_ids = exclude_handled(query, resume_job_id) \
+            .order_by(LeadDB.id) \
+            .yield_per(chunk_size)
+        chunk: List[int] = []
+        for (lead_id,) in lead_ids:
+            chunk.append(lead_id)
+            if len(chunk) >= chunk_size:
+                dispatched += _dispatch_chunk(job_id, chunk, force)
+                checkpoint(job_id, chunk[-1])
+                chunk = []
+        if chunk:
+            dispatched += _dispatch_chunk(job_id, chunk, force)
+            checkpoint(job_id, chunk[-1])
+        mark_dispatched(job_id, dispatched)
+    finally:
+        db.close()
+        finish_dispatch(job_id)
+    print(f"[Celery] Job {job_id}: dispatched {dispatched} punchline pipelines")
+    return {"job_id": job_id, "dispatched": dispatched}
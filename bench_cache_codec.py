@@ -0,0 +1,82 @@
+# bench_cache_codec.py
+"""
+Compare the old stdlib-json cache format with redis_cache.encode_value/decode_value.
+
+    python bench_cache_codec.py            # payload size and encode/decode time only
+    python bench_cache_codec.py --redis    # also time round trips against REDIS_URL
+"""
+import sys
+import json
+import time
+import random
+import asyncio
+
+import redis_cache
+from redis_cache import encode_value, decode_value, cache_client, get_many, set_many, local_cache
+
+PAGE_SIZES = (10, 50, 200)
+REPEAT = 200
+
+
+def fake_lead(i: int) -> dict:
+    rnd = random.Random(i)
+    audits = {
+        f"audit-{n}": {"score": rnd.random(), "displayValue": f"{rnd.randint(1, 9000)} ms", "title": f"Audit number {n}"}
+        for n in range(25)
+    }
+    return {
+        "id": i, "first_name": f"First{i}", "last_name": f"Last{i}", "email": f"lead{i}@example{i % 97}.com",
+        "title": "Head of Marketing", "company": f"Company {i}", "website_url": f"https://example{i}.com",
+        "linkedin_url": f"https://linkedin.com/in/lead{i}", "website_speed_web": rnd.randint(10, 100),
+        "website_speed_mobile": rnd.randint(10, 100), "screenshot_url_web": None, "screenshot_url_mobile": None,
+        "mail_sent": False, "generated_email": "Hi there, " * 40, "pagespeed_diagnostics": audits,
+        "pagespeed_metrics_mobile": {"lcp": rnd.random() * 5000, "cls": rnd.random(), "tbt": rnd.random() * 900},
+        "pagespeed_metrics_desktop": {"lcp": rnd.random() * 3000, "cls": rnd.random(), "tbt": rnd.random() * 400},
+    }
+
+
+def timed(fn, repeat: int = REPEAT) -> float:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat * 1e6
+
+
+def bench_codec():
+    print(f"{'page':>5} {'json bytes':>11} {'codec bytes':>12} {'json enc us':>12} {'codec enc us':>13} {'json dec us':>12} {'codec dec us':>13}")
+    for size in PAGE_SIZES:
+        page = [fake_lead(i) for i in range(size)]
+        old = json.dumps(page)
+        new = encode_value(page)
+        print(
+            f"{size:>5} {len(old.encode()):>11} {len(new):>12}"
+            f" {timed(lambda: json.dumps(page)):>12.0f} {timed(lambda: encode_value(page)):>13.0f}"
+            f" {timed(lambda: json.loads(old)):>12.0f} {timed(lambda: decode_value(new)):>13.0f}"
+        )
+
+
+async def bench_redis(n_keys: int = 50):
+    local_cache.max_entries = 0  # measure Redis, not the in-process tier
+    page = [fake_lead(i) for i in range(10)]
+    keys = [f"bench:codec:{i}" for i in range(n_keys)]
+
+    start = time.perf_counter()
+    for k in keys:
+        await redis_cache.redis_client.setex(k, 60, json.dumps(page))
+    for k in keys:
+        json.loads(await redis_cache.redis_client.get(k))
+    old_ms = (time.perf_counter() - start) * 1000
+
+    start = time.perf_counter()
+    await set_many({k: page for k in keys}, ttl=60)
+    await get_many(keys)
+    new_ms = (time.perf_counter() - start) * 1000
+
+    await cache_client.delete(*keys)
+    print(f"{n_keys} keys set+get: one command per key with json {old_ms:.0f} ms, pipelined set_many/get_many {new_ms:.0f} ms")
+
+
+if __name__ == "__main__":
+    bench_codec()
+    if "--redis" in sys.argv[1:]:
+        asyncio.run(bench_redis())
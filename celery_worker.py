@@ -16,12 +16,28 @@ celery_app = Celery(
     backend=REDIS_URL   # Result backend URL
 )
 
+# Single-lead work clicked from the UI gets its own queue (and reserved workers in start.sh)
+# so it never waits behind bulk jobs
+INTERACTIVE_QUEUE = "interactive"
+
 # Configure the Celery app to use SSL
 celery_app.conf.update(
     broker_use_ssl=True,  # Use SSL for the broker connection
     result_backend_use_ssl=True,  # Use SSL for the backend connection
     broker_transport_options={"ssl_cert_reqs": ssl.CERT_NONE},  # Disable SSL verification (for Upstash)
     result_backend_transport_options={"ssl_cert_reqs": ssl.CERT_NONE},  # Same for result backend
+    # Browser-heavy scraping and rate-limited LLM calls run on separate queues
+    # so each stage can be scaled with its own worker concurrency (see start.sh)
+    # Bulk coordinators go to "bulk"; interactive callers override the stage queues per message
+    task_routes={
+        "background_tasks.scrape_evidence_for_lead": {"queue": "scrape"},
+        "background_tasks.generate_punchlines_for_lead": {"queue": "llm"},
+        "background_tasks.run_speed_test": {"queue": INTERACTIVE_QUEUE},
+        "background_tasks.process_punchlines_for_all_leads": {"queue": "bulk"},
+        "background_speedtest.run_bulk_speedtest_task": {"queue": "bulk"},
+    },
+    # Don't let a worker reserve a backlog of bulk messages it can't start yet
+    worker_prefetch_multiplier=1,
 )
 
 # Ensure configuration is correct
@@ -30,3 +46,5 @@ print(f"Celery Result Backend: {celery_app.conf.result_backend}")
 # Import background tasks (ensure these modules are correctly implemented)
 import background_speedtest
 import background_tasks
+import lead_stats  # noqa: F401  (registers the ORM hooks that keep lead counters current)
+import lead_cache  # noqa: F401  (registers the ORM hooks that invalidate cached lead lists)
@@ -1,23 +1,212 @@
 import os
-from sqlalchemy import create_engine, Column, Integer, String, Boolean, Text, JSON
+import datetime
+import re
+import ssl
+from sqlalchemy import create_engine, Column, Integer, String, Boolean, Text, JSON, DateTime, ForeignKey, Index, inspect, text
+from sqlalchemy.schema import CreateIndex
+from sqlalchemy.engine import make_url, URL
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
+from sqlalchemy.orm import sessionmaker, Session
 from dotenv import load_dotenv
 
 load_dotenv()
 DATABASE_URL = os.getenv("DATABASE_URL")
+# Read-mostly endpoints (lists, exports) go here; unset means they share the primary
+DATABASE_REPLICA_URL = os.getenv("DATABASE_REPLICA_URL") or DATABASE_URL
 
-engine = create_engine(
-    DATABASE_URL,
-    pool_pre_ping=True,  # Checks connection before using
-    pool_recycle=1800    # Recycle connections every 30 minutes
-)
-SessionLocal = sessionmaker(bind=engine)
+# Pool sizing per process role ("api" for uvicorn, "worker" for Celery, set via DB_ROLE in start.sh).
+# A role-prefixed variable (e.g. WORKER_DB_POOL_SIZE) overrides the shared DB_POOL_SIZE.
+DB_ROLE = os.getenv("DB_ROLE", "api")
+
+def _pool_setting(name: str, default: int) -> int:
+    return int(os.getenv(f"{DB_ROLE.upper()}_{name}", os.getenv(name, default)))
+
+POOL_SIZE = _pool_setting("DB_POOL_SIZE", 5)
+MAX_OVERFLOW = _pool_setting("DB_MAX_OVERFLOW", 10)
+POOL_TIMEOUT = _pool_setting("DB_POOL_TIMEOUT", 30)
+POOL_RECYCLE = _pool_setting("DB_POOL_RECYCLE", 1800)  # Recycle connections every 30 minutes
+
+# --- Per-process engines ---
+# Engines are built on first use in each process and dropped in forked children, so a
+# Celery prefork child (or a uvicorn worker) never reuses sockets opened by its parent.
+
+ASYNC_DRIVERS = {"postgresql": "asyncpg", "sqlite": "aiosqlite"}
+
+_engines: dict = {}
+_engines_pid = os.getpid()
+
+# libpq query parameters asyncpg understands under another name; anything else libpq-only
+# (channel_binding, gssencmode, keepalives, ...) is dropped, since asyncpg.connect() rejects it
+_VERIFY_MODES = ("verify-ca", "verify-full")
+
+def _libpq_options(options: str) -> dict:
+    """`-c key=value -c ...` (libpq `options`) -> asyncpg server_settings."""
+    settings, parts = {}, options.split()
+    for i, part in enumerate(parts):
+        if part == "-c" and i + 1 < len(parts):
+            part = parts[i + 1]
+        elif part.startswith("-c"):
+            part = part[2:]
+        else:
+            continue
+        key, _, value = part.partition("=")
+        if key and value:
+            settings[key.replace("-", "_")] = value
+    return settings
+
+def _asyncpg_connect_args(query: dict) -> dict:
+    q = {k: v[-1] if isinstance(v, tuple) else v for k, v in query.items()}
+    args, server_settings = {}, {}
+    sslmode = q.pop("sslmode", None)
+    rootcert, cert, key = q.pop("sslrootcert", None), q.pop("sslcert", None), q.pop("sslkey", None)
+    if rootcert or cert:
+        ctx = ssl.create_default_context(cafile=rootcert)
+        if cert:
+            ctx.load_cert_chain(cert, key)
+        if sslmode not in _VERIFY_MODES:
+            ctx.check_hostname = False
+            if not rootcert:
+                ctx.verify_mode = ssl.CERT_NONE
+        elif sslmode == "verify-ca":
+            ctx.check_hostname = False
+        args["ssl"] = ctx
+    elif sslmode:
+        args["ssl"] = sslmode  # asyncpg takes the libpq sslmode names directly
+    if "connect_timeout" in q:
+        args["timeout"] = float(q.pop("connect_timeout"))
+    if "target_session_attrs" in q:
+        args["target_session_attrs"] = q.pop("target_session_attrs")
+    if "application_name" in q:
+        server_settings["application_name"] = q.pop("application_name")
+    if "options" in q:
+        server_settings.update(_libpq_options(q.pop("options")))
+    if server_settings:
+        args["server_settings"] = server_settings
+    if q:
+        print(f"[DB] Ignoring libpq-only parameters for asyncpg: {', '.join(sorted(q))}")
+    return args
+
+def to_async_url(url: str) -> tuple[URL, dict]:
+    """Swap the sync driver for its async counterpart; returns (url, connect_args)."""
+    u = make_url(url)
+    backend = u.get_backend_name()
+    if backend not in ASYNC_DRIVERS:
+        raise RuntimeError(f"No async driver configured for {backend}")
+    connect_args = {}
+    if backend == "postgresql" and u.query:
+        # Query parameters become asyncpg.connect() kwargs, so none of the libpq ones may stay
+        connect_args = _asyncpg_connect_args(dict(u.query))
+        u = u.difference_update_query(list(u.query))
+    return u.set(drivername=f"{backend}+{ASYNC_DRIVERS[backend]}"), connect_args
+
+def _engine_kwargs(url) -> dict:
+    kwargs = {
+        "pool_pre_ping": True,  # Checks connection before using
+        "pool_recycle": POOL_RECYCLE,
+    }
+    if make_url(url).get_backend_name() != "sqlite":
+        kwargs.update(pool_size=POOL_SIZE, max_overflow=MAX_OVERFLOW, pool_timeout=POOL_TIMEOUT)
+    return kwargs
+
+def _owned_engines() -> dict:
+    global _engines_pid
+    if _engines_pid != os.getpid():
+        # Fork without the at-fork hook (shouldn't happen): forget the parent's engines
+        _engines.clear()
+        _engines_pid = os.getpid()
+    return _engines
+
+def get_engine(replica: bool = False):
+    if replica and DATABASE_REPLICA_URL == DATABASE_URL:
+        replica = False
+    key, url = ("replica_sync", DATABASE_REPLICA_URL) if replica else ("sync", DATABASE_URL)
+    engines = _owned_engines()
+    if key not in engines:
+        engines[key] = create_engine(url, **_engine_kwargs(url))
+        print(f"[DB] Created {DB_ROLE} {'replica ' if replica else ''}engine in pid={os.getpid()} (pool_size={POOL_SIZE}, max_overflow={MAX_OVERFLOW})")
+    return engines[key]
+
+def get_async_engine(replica: bool = False):
+    if replica and DATABASE_REPLICA_URL == DATABASE_URL:
+        replica = False
+    key, base_url = ("replica_async", DATABASE_REPLICA_URL) if replica else ("async", DATABASE_URL)
+    engines = _owned_engines()
+    if key not in engines:
+        url, connect_args = to_async_url(base_url)
+        engines[key] = create_async_engine(url, connect_args=connect_args, **_engine_kwargs(base_url))
+    return engines[key]
+
+def _reset_engines_after_fork() -> None:
+    """In a forked child: drop inherited pools without closing the parent's connections."""
+    global _engines_pid
+    for eng in _engines.values():
+        getattr(eng, "sync_engine", eng).dispose(close=False)
+    _engines.clear()
+    _engines_pid = os.getpid()
+
+os.register_at_fork(after_in_child=_reset_engines_after_fork)
+
+async def dispose_engines() -> None:
+    """Close this process's pools (FastAPI shutdown)."""
+    engines = _owned_engines()
+    for key in ("async", "replica_async"):
+        if key in engines:
+            await engines.pop(key).dispose()
+    for key in ("sync", "replica_sync"):
+        if key in engines:
+            engines.pop(key).dispose()
+
+_sessionmaker = sessionmaker()
+_async_sessionmaker = async_sessionmaker(expire_on_commit=False)
+
+def SessionLocal() -> Session:
+    """New session on this process's engine."""
+    return _sessionmaker(bind=get_engine())
+
+def AsyncSessionLocal() -> AsyncSession:
+    """New async session on this process's async engine (for async endpoints)."""
+    return _async_sessionmaker(bind=get_async_engine())
+
+def ReadSessionLocal() -> Session:
+    """Session for read-only work on the replica (falls back to the primary)."""
+    return _sessionmaker(bind=get_engine(replica=True))
+
+def AsyncReadSessionLocal() -> AsyncSession:
+    return _async_sessionmaker(bind=get_async_engine(replica=True))
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+def get_read_db():
+    db = ReadSessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
 
 Base = declarative_base()
 
 class LeadDB(Base):
     __tablename__ = "leads"
+    __table_args__ = (
+        # Duplicate checks in apollo.fetch_apollo_leads / GoHighLevel.fetch_gohighlevel_leads
+        Index("ix_leads_website_url", "website_url"),
+        Index("ix_leads_linkedin_url", "linkedin_url"),
+        # /upload-csv fallback match on (company, website_url)
+        Index("ix_leads_company_website_url", "company", "website_url"),
+        # Incremental punchline index sync (punchline_index.SyncedPunchlineIndex.sync)
+        Index("ix_leads_punchlines_generated_at", "punchlines_generated_at"),
+        # /leads keyset pages on Postgres: WHERE email IS NOT NULL AND website_url IS NOT NULL
+        # AND id > :after ORDER BY id. SQLite seeks the rowid range instead (id is the rowid),
+        # and offset pages scan past skipped rows on either backend.
+        Index(
+            "ix_leads_listable_id", "id",
+            postgresql_where=text("email IS NOT NULL AND website_url IS NOT NULL"),
+            sqlite_where=text("email IS NOT NULL AND website_url IS NOT NULL"),
+        ),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     first_name = Column(String)
@@ -47,7 +236,140 @@ class LeadDB(Base):
     punchline1 = Column(String, nullable=True)
     punchline2 = Column(String, nullable=True)
     punchline3 = Column(String, nullable=True)
+    punchline_evidence = Column(JSON, nullable=True)  # pick_evidence() output from the scrape stage
+    evidence_fingerprint = Column(String, nullable=True)  # fingerprint of the evidence the punchlines were generated from
+    punchlines_generated_at = Column(DateTime, nullable=True)
+
+
+class BulkJobDB(Base):
+    """Ledger entry for one bulk run; id is the Celery task id of the run that created it."""
+    __tablename__ = "bulk_jobs"
+
+    id = Column(String, primary_key=True)
+    kind = Column(String, nullable=False)  # "punchlines" | "speedtest"
+    status = Column(String, default="running")
+    params = Column(JSON, nullable=True)
+    last_lead_id = Column(Integer, nullable=True)  # checkpoint: highest lead id handled/dispatched so far
+    total = Column(Integer, nullable=True)  # leads expected to get an outcome (fan-out jobs)
+    handled = Column(Integer, nullable=True)  # leads with a recorded outcome (bulk_job_items rows)
+    created_at = Column(DateTime, default=datetime.datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.datetime.utcnow, onupdate=datetime.datetime.utcnow)
+
+
+class BulkJobItemDB(Base):
+    __tablename__ = "bulk_job_items"
+
+    job_id = Column(String, ForeignKey("bulk_jobs.id", ondelete="CASCADE"), primary_key=True)
+    lead_id = Column(Integer, primary_key=True)
+    outcome = Column(String, nullable=False)  # "processed" | "skipped" | "failed"
+    detail = Column(Text, nullable=True)
+    updated_at = Column(DateTime, default=datetime.datetime.utcnow, onupdate=datetime.datetime.utcnow)
+
+
+class LeadStatDB(Base):
+    """Running lead counters maintained by lead_stats.py (one row per counter)."""
+    __tablename__ = "lead_stats"
+
+    name = Column(String, primary_key=True)
+    value = Column(Integer, nullable=False, default=0)
+
+
+def add_missing_columns(bind=None):
+    """create_all() never alters existing tables, so add any new (nullable) model columns in place."""
+    bind = bind or get_engine()
+    insp = inspect(bind)
+    with bind.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            if not insp.has_table(table.name):
+                continue
+            existing = {c["name"] for c in insp.get_columns(table.name)}
+            for col in table.columns:
+                if col.name in existing:
+                    continue
+                col_type = col.type.compile(dialect=bind.dialect)
+                conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {col.name} {col_type}"))
+                print(f"[DB] Added column {table.name}.{col.name} ({col_type})")
+
+
+def add_missing_indexes(bind=None):
+    """Create model indexes that existing tables don't have yet (CONCURRENTLY on Postgres, so writes keep flowing)."""
+    bind = bind or get_engine()
+    insp = inspect(bind)
+    for table in Base.metadata.sorted_tables:
+        if not insp.has_table(table.name):
+            continue
+        existing = {ix["name"] for ix in insp.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name in existing:
+                continue
+            ddl = str(CreateIndex(index).compile(dialect=bind.dialect))
+            if bind.dialect.name == "postgresql":
+                ddl = re.sub(r"^CREATE (UNIQUE )?INDEX", r"CREATE \1INDEX CONCURRENTLY", ddl)
+                with bind.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+                    conn.execute(text(ddl))
+            else:
+                with bind.begin() as conn:
+                    conn.execute(text(ddl))
+            print(f"[DB] Created index {index.name} on {table.name}")
+
+
+# --- Lead text search index (used by lead_search.py) ---
+
+SEARCH_FIELDS = ("first_name", "last_name", "company", "email", "title", "website_url")
+# Postgres expression index and the query in lead_search must use this exact text to match
+SEARCH_DOC_SQL = "lower(" + " || ' ' || ".join(f"coalesce({f}, '')" for f in SEARCH_FIELDS) + ")"
+
+SQLITE_FTS_DDL = [
+    f"CREATE VIRTUAL TABLE leads_fts USING fts5({', '.join(SEARCH_FIELDS)}, content='leads', content_rowid='id', tokenize='trigram')",
+    f"""CREATE TRIGGER leads_fts_ai AFTER INSERT ON leads BEGIN
+        INSERT INTO leads_fts(rowid, {', '.join(SEARCH_FIELDS)}) VALUES (new.id, {', '.join('new.' + f for f in SEARCH_FIELDS)});
+    END""",
+    f"""CREATE TRIGGER leads_fts_ad AFTER DELETE ON leads BEGIN
+        INSERT INTO leads_fts(leads_fts, rowid, {', '.join(SEARCH_FIELDS)}) VALUES ('delete', old.id, {', '.join('old.' + f for f in SEARCH_FIELDS)});
+    END""",
+    f"""CREATE TRIGGER leads_fts_au AFTER UPDATE ON leads BEGIN
+        INSERT INTO leads_fts(leads_fts, rowid, {', '.join(SEARCH_FIELDS)}) VALUES ('delete', old.id, {', '.join('old.' + f for f in SEARCH_FIELDS)});
+        INSERT INTO leads_fts(rowid, {', '.join(SEARCH_FIELDS)}) VALUES (new.id, {', '.join('new.' + f for f in SEARCH_FIELDS)});
+    END""",
+    "INSERT INTO leads_fts(leads_fts) VALUES ('rebuild')",
+]
+
+
+def add_search_index(bind=None):
+    """Trigram GIN index on Postgres, FTS5 (trigram tokenizer) shadow table kept in sync by triggers on SQLite."""
+    bind = bind or get_engine()
+    if bind.dialect.name == "postgresql":
+        try:
+            with bind.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+                conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+                conn.execute(text(
+                    f"CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_leads_search_trgm "
+                    f"ON leads USING gin (({SEARCH_DOC_SQL}) gin_trgm_ops)"
+                ))
+        except Exception as e:
+            print(f"[DB] Could not create trigram search index: {e}")
+    elif bind.dialect.name == "sqlite":
+        if inspect(bind).has_table("leads_fts"):
+            return
+        with bind.begin() as conn:
+            for ddl in SQLITE_FTS_DDL:
+                conn.execute(text(ddl))
+        print("[DB] Created leads_fts search table")
+
+
+def init_db(bind=None):
+    """
+    Create missing tables and bring existing ones up to the current models in place.
+    Runs at API startup (main.lifespan) or via `python database.py`, never at import.
+    """
+    bind = bind or get_engine()
+    # Base.metadata.drop_all(bind=bind)  # Drop existing tables
+    Base.metadata.create_all(bind=bind)  # Create missing tables
+    add_missing_columns(bind)
+    add_missing_indexes(bind)
+    add_search_index(bind)
 
 
-# Base.metadata.drop_all(bind=engine)  # Drop existing tables
-Base.metadata.create_all(bind=engine)  # Create the tables again
\ No newline at end of file
+if __name__ == "__main__":
+    import auth.schemas  # noqa: F401  (register the users table)
+    init_db()
\ No newline at end of file
@@ -0,0 +1,164 @@
+# ghl_client.py
+import os
+import time
+import random
+import asyncio
+import threading
+from typing import Optional
+
+import httpx
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# One keep-alive (HTTP/2) connection pool to LeadConnector per process, shared by the inbox,
+# mail sending and contact import. Async callers use request(), sync ones request_sync().
+GHL_API_BASE = "https://services.leadconnectorhq.com"
+GHL_API_KEY = os.getenv("GOHIGHLEVEL_KEY")
+LOCATION_ID = os.getenv("GOHIGHLEVEL_LOCATION_ID")
+
+GHL_MAX_CONNECTIONS = int(os.getenv("GHL_MAX_CONNECTIONS", "20"))
+GHL_TIMEOUT_SEC = float(os.getenv("GHL_TIMEOUT_SEC", "30"))
+GHL_MAX_RETRIES = int(os.getenv("GHL_MAX_RETRIES", "3"))
+GHL_BACKOFF_BASE_SEC = float(os.getenv("GHL_BACKOFF_BASE_SEC", "0.5"))
+# GHL allows 100 requests per 10 seconds per location; stay a little under it
+GHL_RATE_PER_SEC = float(os.getenv("GHL_RATE_PER_SEC", "9"))
+GHL_RATE_BURST = int(os.getenv("GHL_RATE_BURST", "20"))
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+# A POST that got a 5xx may still have been applied (e.g. an email sent), so only 429 is retried
+IDEMPOTENT_METHODS = {"GET", "HEAD", "OPTIONS", "PUT", "DELETE"}
+
+
+class TokenBucket:
+    """Thread-safe token bucket; reserve() returns how long the caller must wait for its token."""
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self) -> float:
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+
+class GHLClient:
+    def __init__(self):
+        self._async: Optional[httpx.AsyncClient] = None
+        self._sync: Optional[httpx.Client] = None
+        self._sync_lock = threading.Lock()
+        self._buckets: dict[str, TokenBucket] = {}
+        self._buckets_lock = threading.Lock()
+
+    def _client_kwargs(self) -> dict:
+        return dict(
+            base_url=GHL_API_BASE,
+            http2=True,
+            timeout=GHL_TIMEOUT_SEC,
+            limits=httpx.Limits(max_connections=GHL_MAX_CONNECTIONS, max_keepalive_connections=GHL_MAX_CONNECTIONS),
+            headers={"Authorization": f"Bearer {GHL_API_KEY}", "Accept": "application/json"},
+        )
+
+    # --- Lifecycle (FastAPI lifespan) ---
+
+    async def start(self) -> None:
+        if self._async is None or self._async.is_closed:
+            self._async = httpx.AsyncClient(**self._client_kwargs())
+
+    async def aclose(self) -> None:
+        if self._async is not None:
+            await self._async.aclose()
+            self._async = None
+        with self._sync_lock:
+            if self._sync is not None:
+                self._sync.close()
+                self._sync = None
+
+    def _sync_client(self) -> httpx.Client:
+        with self._sync_lock:
+            if self._sync is None or self._sync.is_closed:
+                self._sync = httpx.Client(**self._client_kwargs())
+            return self._sync
+
+    # --- Retry / rate limit policy ---
+
+    def _bucket(self, location_id: Optional[str]) -> TokenBucket:
+        key = location_id or LOCATION_ID or "default"
+        with self._buckets_lock:
+            if key not in self._buckets:
+                self._buckets[key] = TokenBucket(GHL_RATE_PER_SEC, GHL_RATE_BURST)
+            return self._buckets[key]
+
+    @staticmethod
+    def _retry_delay(method: str, attempt: int, response: Optional[httpx.Response]) -> Optional[float]:
+        """Seconds to wait before retrying, or None to give up and return/raise as is."""
+        if attempt >= GHL_MAX_RETRIES:
+            return None
+        if response is not None:
+            if response.status_code not in RETRY_STATUSES:
+                return None
+            if response.status_code != 429 and method not in IDEMPOTENT_METHODS:
+                return None
+            retry_after = response.headers.get("Retry-After")
+            if retry_after and retry_after.isdigit():
+                return float(retry_after)
+        return GHL_BACKOFF_BASE_SEC * (2 ** attempt) * (0.5 + random.random())
+
+    async def request(self, method: str, url: str, location_id: Optional[str] = None, **kwargs) -> httpx.Response:
+        if self._async is None or self._async.is_closed:
+            await self.start()
+        method = method.upper()
+        bucket = self._bucket(location_id)
+        attempt = 0
+        while True:
+            wait = bucket.reserve()
+            if wait:
+                await asyncio.sleep(wait)
+            try:
+                response = await self._async.request(method, url, **kwargs)
+            except (httpx.ConnectError, httpx.ConnectTimeout) as e:
+                delay = self._retry_delay(method, attempt, None)
+                if delay is None:
+                    raise
+                print(f"[GHL] {method} {url} failed to connect ({e}); retrying in {delay:.1f}s")
+            else:
+                delay = self._retry_delay(method, attempt, response)
+                if delay is None:
+                    return response
+                print(f"[GHL] {method} {url} -> {response.status_code}; retrying in {delay:.1f}s")
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    def request_sync(self, method: str, url: str, location_id: Optional[str] = None, **kwargs) -> httpx.Response:
+        client = self._sync_client()
+        method = method.upper()
+        bucket = self._bucket(location_id)
+        attempt = 0
+        while True:
+            wait = bucket.reserve()
+            if wait:
+                time.sleep(wait)
+            try:
+                response = client.request(method, url, **kwargs)
+            except (httpx.ConnectError, httpx.ConnectTimeout) as e:
+                delay = self._retry_delay(method, attempt, None)
+                if delay is None:
+                    raise
+                print(f"[GHL] {method} {url} failed to connect ({e}); retrying in {delay:.1f}s")
+            else:
+                delay = self._retry_delay(method, attempt, response)
+                if delay is None:
+                    return response
+                print(f"[GHL] {method} {url} -> {response.status_code}; retrying in {delay:.1f}s")
+            time.sleep(delay)
+            attempt += 1
+
+
+ghl = GHLClient()
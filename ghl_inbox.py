@@ -1,23 +1,28 @@
 import os
+import asyncio
 import httpx
 from fastapi import APIRouter, HTTPException, Request
 from bs4 import BeautifulSoup
 from pydantic import BaseModel
 from typing import List, Optional
-from redis_cache import get_cached_conversation, cache_inbox, cache_conversation, get_cached_inbox
+from redis_cache import get_cached_conversation, cache_conversation, get_or_compute, \
+    get_cached_message_bodies, cache_message_bodies
+from ghl_client import ghl, LOCATION_ID
 
-GHL_API_BASE = "https://services.leadconnectorhq.com"
-GoHighLevel_key = os.getenv("GOHIGHLEVEL_KEY")
-LOCATION_ID = os.getenv("GOHIGHLEVEL_LOCATION_ID")
+# Auth and Accept come from the shared client (ghl_client.py)
+HEADERS = {"Version": "2021-04-15"}
 
-HEADERS = {
-    "Authorization": f"Bearer {GoHighLevel_key}",
-    "Version": "2021-04-15",
-    "Accept": "application/json"
-}
+# Message detail requests in flight at once for a single thread
+DETAIL_CONCURRENCY = int(os.getenv("GHL_DETAIL_CONCURRENCY", "8"))
 
 router = APIRouter(prefix="/emails", tags=["Inbox"])
 
+def purge_html(html: str) -> str:
+    if "<" not in html and "&" not in html:
+        return html.strip()  # plain text: skip the parser
+    soup = BeautifulSoup(html, "lxml")
+    return soup.get_text(separator="\n", strip=True)
+
 class Message(BaseModel):
     sender: str  # "agent" or "user"
     content: str
@@ -34,39 +39,36 @@ class RegenerateEmailResponse(BaseModel):
 async def get_inbox_conversations(limit: int = 20, startAfter: str = None):
     # Build a unique cache key based on pagination params
     cache_key = f"inbox:list:limit={limit}:startAfter={startAfter or 'none'}"
-
-    # Try to get from cache
-    cached = await get_cached_inbox(cache_key)
-    if cached:
-        return {"source": "cache", "inbox": cached}
-
-    # Fallback to GHL API
-    url = f"{GHL_API_BASE}/conversations/?locationId={LOCATION_ID}&limit={limit}"
-    if startAfter:
-        url += f"&startAfter={startAfter}"
+    source = "cache"
+
+    async def load():
+        nonlocal source
+        source = "ghl"
+        params = {"locationId": LOCATION_ID, "limit": limit}
+        if startAfter:
+            params["startAfter"] = startAfter
+
+        resp = await ghl.request("GET", "/conversations/", location_id=LOCATION_ID, params=params, headers=HEADERS)
+        resp.raise_for_status()
+        data = resp.json()
+        raw_conversations = data.get("conversations", [])
+
+        email_conversations = []
+        for convo in raw_conversations:
+            if convo.get("lastMessageType") == "TYPE_EMAIL":
+                email_conversations.append({
+                    "conversation_id": convo.get("id"),
+                    "contact_id": convo.get("contactId"),
+                    "contact_name": convo.get("contact", {}).get("name"),
+                    "last_message_snippet": convo.get("lastMessageText"),
+                    "last_updated": convo.get("updatedAt")
+                })
+        return email_conversations
 
     try:
-        async with httpx.AsyncClient() as client:
-            resp = await client.get(url, headers=HEADERS)
-            resp.raise_for_status()
-            data = resp.json()
-            raw_conversations = data.get("conversations", [])
-
-            email_conversations = []
-            for convo in raw_conversations:
-                if convo.get("lastMessageType") == "TYPE_EMAIL":
-                    email_conversations.append({
-                        "conversation_id": convo.get("id"),
-                        "contact_id": convo.get("contactId"),
-                        "contact_name": convo.get("contact", {}).get("name"),
-                        "last_message_snippet": convo.get("lastMessageText"),
-                        "last_updated": convo.get("updatedAt")
-                    })
-
-            # Cache the result for 2 minutes (adjustable)
-            await cache_inbox(cache_key, email_conversations, ttl=120)
-
-            return {"source": "ghl", "inbox": email_conversations}
+        # Cached for 2 minutes; concurrent misses share one GHL call (adjustable)
+        inbox = await get_or_compute(cache_key, load, ttl=120)
+        return {"source": source, "inbox": inbox}
 
     except httpx.HTTPStatusError as exc:
         raise HTTPException(status_code=exc.response.status_code, detail=exc.response.text)
@@ -77,44 +79,44 @@ async def get_conversation_messages(conversation_id: str):
     if cached:
         return {"conversation_id": conversation_id, "messages": cached}
 
-    messages_url = f"{GHL_API_BASE}/conversations/{conversation_id}/messages"
-
-    def purge_html(html: str) -> str:
-        soup = BeautifulSoup(html, "html.parser")
-        return soup.get_text(separator="\n", strip=True)
+    messages_url = f"/conversations/{conversation_id}/messages"
 
     try:
-        async with httpx.AsyncClient() as client:
-            resp = await client.get(messages_url, headers=HEADERS)
-            resp.raise_for_status()
-            message_metadata = resp.json().get("messages", {}).get("messages", [])
-
-            full_messages = []
-            for msg in message_metadata:
-                msg_id = msg.get("id")
-                if not msg_id:
-                    continue
-
-                detail_url = f"{GHL_API_BASE}/conversations/messages/{msg_id}"
-                detail_resp = await client.get(detail_url, headers=HEADERS)
-                detail_resp.raise_for_status()
+        resp = await ghl.request("GET", messages_url, location_id=LOCATION_ID, headers=HEADERS)
+        resp.raise_for_status()
+        message_metadata = [m for m in resp.json().get("messages", {}).get("messages", []) if m.get("id")]
 
-                detail_response = detail_resp.json().get("message", {})
-                raw_body = detail_response.get("body", "")
-                clean_body = purge_html(raw_body)
+        # Bodies are immutable: only fetch the ones not cleaned before, a few at a time
+        bodies = await get_cached_message_bodies([m["id"] for m in message_metadata])
+        semaphore = asyncio.Semaphore(DETAIL_CONCURRENCY)
 
-                full_messages.append({
-                    "id": msg_id,
-                    "type": msg.get("messageType"),
-                    "direction": msg.get("direction"),
-                    "body": clean_body,
-                    "date": msg.get("dateAdded")
-                })
-
-            # Sort by date and cache
-            full_messages.sort(key=lambda x: x["date"])
-            await cache_conversation(conversation_id, full_messages, ttl=300)
-            return {"conversation_id": conversation_id, "messages": full_messages}
+        async def fetch_body(msg_id: str) -> str:
+            async with semaphore:
+                detail_resp = await ghl.request("GET", f"/conversations/messages/{msg_id}", location_id=LOCATION_ID, headers=HEADERS)
+                detail_resp.raise_for_status()
+            detail_response = detail_resp.json().get("message", {})
+            return purge_html(detail_response.get("body") or "")
+
+        missing = [m["id"] for m in message_metadata if m["id"] not in bodies]
+        fetched = dict(zip(missing, await asyncio.gather(*(fetch_body(m) for m in missing))))
+        await cache_message_bodies(fetched)
+        bodies.update(fetched)
+
+        full_messages = [
+            {
+                "id": msg["id"],
+                "type": msg.get("messageType"),
+                "direction": msg.get("direction"),
+                "body": bodies[msg["id"]],
+                "date": msg.get("dateAdded")
+            }
+            for msg in message_metadata
+        ]
+
+        # Sort by date and cache
+        full_messages.sort(key=lambda x: x["date"])
+        await cache_conversation(conversation_id, full_messages, ttl=300)
+        return {"conversation_id": conversation_id, "messages": full_messages}
 
     except httpx.HTTPStatusError as exc:
         raise HTTPException(status_code=exc.response.status_code, detail=exc.response.text)
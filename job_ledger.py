@@ -0,0 +1,153 @@
+# job_ledger.py
+import os
+import datetime
+from typing import Optional
+from sqlalchemy import func, exists
+from sqlalchemy.orm import Query
+
+import job_progress
+from database import SessionLocal, LeadDB, BulkJobDB, BulkJobItemDB
+
+# Durable record of bulk runs (Postgres) so a killed worker or a deploy can resume from the
+# checkpoint; job_progress keeps the live counters in Redis alongside it.
+
+ACTIVE_STATUSES = ("running", "dispatched", "resuming")
+# An active job with no ledger writes (checkpoints or outcomes) for this long has lost its workers
+JOB_STALE_SEC = int(os.getenv("JOB_STALE_SEC", "900"))
+
+def start_job(job_id: str, kind: str, params: dict = None) -> BulkJobDB:
+    db = SessionLocal()
+    try:
+        job = BulkJobDB(id=job_id, kind=kind, status="running", params=params or {}, total=0, handled=0)
+        db.add(job)
+        db.commit()
+        db.refresh(job)
+        db.expunge(job)
+    finally:
+        db.close()
+    job_progress.start_job(job_id, kind)
+    return job
+
+def resume_job(job_id: str) -> Optional[BulkJobDB]:
+    """Mark an existing job running again and re-seed its live counters from the ledger."""
+    db = SessionLocal()
+    try:
+        job = db.query(BulkJobDB).filter(BulkJobDB.id == job_id).first()
+        if not job:
+            return None
+        counts = outcome_counts(db, job_id)
+        job.status = "running"
+        job.total = job.handled = sum(counts.values())
+        db.commit()
+        db.refresh(job)
+        db.expunge(job)
+    finally:
+        db.close()
+    job_progress.start_job(job_id, job.kind, counts=counts)
+    return job
+
+def get_job(job_id: str) -> Optional[BulkJobDB]:
+    db = SessionLocal()
+    try:
+        job = db.query(BulkJobDB).filter(BulkJobDB.id == job_id).first()
+        if job:
+            db.expunge(job)
+        return job
+    finally:
+        db.close()
+
+def resume_blocker(job_id: str) -> Optional[str]:
+    """Why the job must not be resumed right now, or None if it can be."""
+    db = SessionLocal()
+    try:
+        job = db.query(BulkJobDB).filter(BulkJobDB.id == job_id).first()
+        if not job or job.status not in ACTIVE_STATUSES:
+            return None
+        last_item = db.query(func.max(BulkJobItemDB.updated_at)).filter(BulkJobItemDB.job_id == job_id).scalar()
+        last_activity = max(t for t in (job.updated_at or job.created_at, last_item) if t is not None)
+        idle = (datetime.datetime.utcnow() - last_activity).total_seconds()
+        if idle >= JOB_STALE_SEC:
+            return None
+        return f"Job is {job.status} (last activity {int(idle)}s ago); pass force=true to resume anyway"
+    finally:
+        db.close()
+
+def mark_dispatched(job_id: str, dispatched: int) -> None:
+    """Every lead is queued; the job completes once outcomes for all of them are recorded."""
+    db = SessionLocal()
+    try:
+        db.query(BulkJobDB).filter(BulkJobDB.id == job_id).update({
+            "status": "dispatched",
+            "total": func.coalesce(BulkJobDB.total, 0) + dispatched,
+        }, synchronize_session=False)
+        # Fast workers may have finished everything before dispatch did
+        _complete_if_done(db, job_id)
+        db.commit()
+    finally:
+        db.close()
+
+def _complete_if_done(db, job_id: str) -> None:
+    """Flip a dispatched job to completed once its handled counter reaches total (caller commits)."""
+    db.query(BulkJobDB).filter(
+        BulkJobDB.id == job_id,
+        BulkJobDB.status == "dispatched",
+        BulkJobDB.total <= BulkJobDB.handled,
+    ).update({"status": "completed"}, synchronize_session=False)
+
+def set_status(job_id: str, status: str) -> None:
+    db = SessionLocal()
+    try:
+        db.query(BulkJobDB).filter(BulkJobDB.id == job_id).update({"status": status})
+        db.commit()
+    finally:
+        db.close()
+
+def checkpoint(job_id: str, lead_id: int) -> None:
+    db = SessionLocal()
+    try:
+        db.query(BulkJobDB).filter(BulkJobDB.id == job_id).update({"last_lead_id": lead_id})
+        db.commit()
+    finally:
+        db.close()
+
+def record_outcome(job_id: Optional[str], lead_id: int, outcome: str, detail: str = None) -> None:
+    """Persist a lead's outcome for the job and bump the live counters; no-op outside bulk jobs."""
+    if not job_id:
+        return
+    db = SessionLocal()
+    try:
+        item = db.query(BulkJobItemDB).filter(
+            BulkJobItemDB.job_id == job_id,
+            BulkJobItemDB.lead_id == lead_id
+        ).first()
+        if item:
+            item.outcome = outcome
+            item.detail = detail
+        else:
+            # First outcome for this lead: count it, in the same transaction as the row
+            db.add(BulkJobItemDB(job_id=job_id, lead_id=lead_id, outcome=outcome, detail=detail))
+            db.query(BulkJobDB).filter(BulkJobDB.id == job_id).update(
+                {"handled": func.coalesce(BulkJobDB.handled, 0) + 1}, synchronize_session=False
+            )
+            _complete_if_done(db, job_id)
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        print(f"[Ledger] Could not record {outcome} for lead {lead_id} in job {job_id}: {e}")
+    finally:
+        db.close()
+    job_progress.record_outcome(job_id, lead_id, outcome, detail)
+
+def outcome_counts(db, job_id: str) -> dict:
+    rows = db.query(BulkJobItemDB.outcome, func.count()) \
+        .filter(BulkJobItemDB.job_id == job_id) \
+        .group_by(BulkJobItemDB.outcome) \
+        .all()
+    return {outcome: count for outcome, count in rows}
+
+def exclude_handled(query: Query, job_id: Optional[str]) -> Query:
+    """Drop leads that already have an outcome in this job (no-op for a fresh run)."""
+    if not job_id:
+        return query
+    handled = exists().where(BulkJobItemDB.job_id == job_id, BulkJobItemDB.lead_id == LeadDB.id)
+    return query.filter(~handled)
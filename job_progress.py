@@ -0,0 +1,100 @@
+# job_progress.py
+import json
+from typing import Optional
+from celery.signals import task_postrun
+from redis_cache import sync_redis_client
+
+# Aggregate progress for fan-out bulk jobs, keyed by the parent task id.
+# Every change is also published on task_events_channel() for the /task-events SSE stream.
+PROGRESS_TTL = 7 * 24 * 3600
+MAX_FAILURES_KEPT = 500
+COUNTER_FIELDS = ("total", "processed", "skipped", "failed", "current_lead")
+
+def _key(job_id: str) -> str:
+    return f"job:{job_id}:progress"
+
+def _failures_key(job_id: str) -> str:
+    return f"job:{job_id}:failures"
+
+def task_events_channel(task_id: str) -> str:
+    return f"task-events:{task_id}"
+
+def _summarize(raw: dict) -> dict:
+    progress = {k: int(v) if k in COUNTER_FIELDS else v for k, v in raw.items()}
+    finished = sum(progress.get(k, 0) for k in ("processed", "skipped", "failed"))
+    if progress.get("status") == "running" and finished >= progress.get("total", 0):
+        progress["status"] = "done"
+    return progress
+
+def _publish(task_id: str, event: str, payload: dict, final: bool = False) -> None:
+    try:
+        sync_redis_client.publish(
+            task_events_channel(task_id),
+            json.dumps({"event": event, "task_id": task_id, "final": final, **payload})
+        )
+    except Exception as e:
+        print(f"[Progress] Could not publish {event} for {task_id}: {e}")
+
+def _publish_progress(job_id: str, raw: dict, **extra) -> None:
+    progress = _summarize(raw)
+    _publish(job_id, "progress", {**progress, **extra}, final=progress.get("status") == "done")
+
+def start_job(job_id: str, kind: str, counts: dict = None) -> None:
+    """Reset the counters; a resumed job passes the outcome counts already in the ledger."""
+    counts = counts or {}
+    done = sum(counts.get(k, 0) for k in ("processed", "skipped", "failed"))
+    pipe = sync_redis_client.pipeline()
+    pipe.hset(_key(job_id), mapping={
+        "kind": kind, "status": "dispatching", "total": done,
+        "processed": counts.get("processed", 0),
+        "skipped": counts.get("skipped", 0),
+        "failed": counts.get("failed", 0),
+    })
+    pipe.expire(_key(job_id), PROGRESS_TTL)
+    pipe.hgetall(_key(job_id))
+    _publish_progress(job_id, pipe.execute()[-1])
+
+def add_total(job_id: str, n: int) -> None:
+    sync_redis_client.hincrby(_key(job_id), "total", n)
+
+def finish_dispatch(job_id: str) -> None:
+    pipe = sync_redis_client.pipeline()
+    pipe.hset(_key(job_id), "status", "running")
+    pipe.hgetall(_key(job_id))
+    _publish_progress(job_id, pipe.execute()[-1])
+
+def record_outcome(job_id: Optional[str], lead_id: int, outcome: str, reason: str = None) -> None:
+    """outcome is "processed", "skipped" or "failed"; no-op for tasks that are not part of a bulk job."""
+    if not job_id:
+        return
+    try:
+        pipe = sync_redis_client.pipeline()
+        pipe.hincrby(_key(job_id), outcome, 1)
+        pipe.hset(_key(job_id), "current_lead", lead_id)
+        if outcome == "failed":
+            pipe.rpush(_failures_key(job_id), json.dumps({"lead_id": lead_id, "reason": reason}))
+            pipe.ltrim(_failures_key(job_id), -MAX_FAILURES_KEPT, -1)
+            pipe.expire(_failures_key(job_id), PROGRESS_TTL)
+        pipe.hgetall(_key(job_id))
+        raw = pipe.execute()[-1]
+    except Exception as e:
+        print(f"[Progress] Could not record {outcome} for lead {lead_id} in job {job_id}: {e}")
+        return
+    _publish_progress(job_id, raw, lead_id=lead_id, outcome=outcome, reason=reason)
+
+def get_progress(job_id: str, include_failures: bool = True) -> Optional[dict]:
+    raw = sync_redis_client.hgetall(_key(job_id))
+    if not raw:
+        return None
+    progress = _summarize(raw)
+    if include_failures:
+        progress["failures"] = [json.loads(f) for f in sync_redis_client.lrange(_failures_key(job_id), 0, -1)]
+    return progress
+
+@task_postrun.connect
+def _publish_task_finished(task_id=None, state=None, kwargs=None, **_):
+    """Close out event streams: plain tasks end here, bulk jobs end when their counters are done."""
+    job_id = (kwargs or {}).get("resume_job_id") or task_id
+    progress = get_progress(job_id, include_failures=False)
+    final = progress is None or progress.get("status") == "done"
+    _publish(job_id, "task_finished", {"state": state, "progress": progress}, final=final)
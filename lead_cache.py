@@ -0,0 +1,71 @@
+# lead_cache.py
+import asyncio
+from sqlalchemy import event
+from sqlalchemy.orm import Session, attributes
+
+from database import LeadDB
+from redis_cache import invalidate_leads, ainvalidate_leads
+
+# Sessions that wrote leads invalidate the Redis lead cache once, after the commit is durable
+# (invalidating before commit would let a reader re-cache the old rows).
+# Per-lead entries are dropped by id; list pages only when membership may have changed.
+_MEMBERSHIP = "leads_membership_changed"
+_UPDATED = "leads_updated_ids"
+_PENDING = "leads_invalidation_tasks"
+
+# Strong references so queued invalidations aren't garbage-collected mid-flight
+_inflight: set = set()
+
+# Columns in the /leads filter: editing them can move a lead in or out of a page
+MEMBERSHIP_COLUMNS = ("email", "website_url")
+
+def mark_leads_changed(session: Session) -> None:
+    """For inserts/deletes that bypass the flush hooks (bulk mappings, query.delete())."""
+    session.info[_MEMBERSHIP] = True
+
+def mark_leads_updated(session: Session, lead_ids) -> None:
+    """For updates that bypass the flush hooks (bulk mappings, query.update())."""
+    session.info.setdefault(_UPDATED, set()).update(lead_ids)
+
+@event.listens_for(Session, "before_flush")
+def _note_lead_writes(session, flush_context, instances):
+    if any(isinstance(obj, LeadDB) for obj in session.new):
+        mark_leads_changed(session)
+    for obj in session.deleted:
+        if isinstance(obj, LeadDB):
+            mark_leads_changed(session)
+            mark_leads_updated(session, [obj.id])
+    for obj in session.dirty:
+        if isinstance(obj, LeadDB) and session.is_modified(obj):
+            mark_leads_updated(session, [obj.id])
+            if any(attributes.get_history(obj, col).has_changes() for col in MEMBERSHIP_COLUMNS):
+                mark_leads_changed(session)
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_after_commit(session):
+    membership = session.info.pop(_MEMBERSHIP, False)
+    updated = session.info.pop(_UPDATED, set())
+    if not (membership or updated):
+        return
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        invalidate_leads(updated, membership)
+        return
+    # Committed through an AsyncSession (run_sync or await commit()), so this runs on the
+    # event loop where the blocking client would stall every request; queue the async one
+    task = loop.create_task(ainvalidate_leads(updated, membership))
+    _inflight.add(task)
+    task.add_done_callback(_inflight.discard)
+    session.info.setdefault(_PENDING, []).append(task)
+
+async def wait_for_invalidations(session) -> None:
+    """Await invalidations queued by this (async) session's commits, so the caller's next read is fresh."""
+    tasks = session.info.pop(_PENDING, [])
+    if tasks:
+        await asyncio.gather(*tasks)
+
+@event.listens_for(Session, "after_rollback")
+def _forget_on_rollback(session):
+    session.info.pop(_MEMBERSHIP, None)
+    session.info.pop(_UPDATED, None)
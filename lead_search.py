@@ -0,0 +1,88 @@
+# lead_search.py
+import re
+from typing import Optional, List
+from sqlalchemy import select, text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database import LeadDB, SEARCH_DOC_SQL, SEARCH_FIELDS
+
+# Postgres: word_similarity() threshold for the fuzzy "<%" match (pg_trgm default is 0.6)
+FUZZY_THRESHOLD = 0.4
+# SQLite's trigram tokenizer can't match terms shorter than 3 characters
+MIN_TRIGRAM_LEN = 3
+# Patterns escape %, _ and \ with a backslash; SQLite has no default LIKE escape character
+LIKE_ESCAPE = "ESCAPE '\\'"
+
+
+def _filters(min_speed_web, max_speed_web, min_speed_mobile, max_speed_mobile, mail_sent, alias: str) -> tuple[List[str], dict]:
+    clauses, params = [], {}
+    for name, column, op, value in (
+        ("min_web", "website_speed_web", ">=", min_speed_web),
+        ("max_web", "website_speed_web", "<=", max_speed_web),
+        ("min_mob", "website_speed_mobile", ">=", min_speed_mobile),
+        ("max_mob", "website_speed_mobile", "<=", max_speed_mobile),
+        ("mail_sent", "mail_sent", "=", mail_sent),
+    ):
+        if value is not None:
+            clauses.append(f"{alias}.{column} {op} :{name}")
+            params[name] = value
+    return clauses, params
+
+
+def _postgres_query(q: str, where: List[str]) -> str:
+    conds = " AND ".join([f"({SEARCH_DOC_SQL} LIKE :pattern {LIKE_ESCAPE} OR :q <% {SEARCH_DOC_SQL})"] + where)
+    return (
+        f"SELECT l.id, word_similarity(:q, {SEARCH_DOC_SQL}) "
+        f"+ CASE WHEN {SEARCH_DOC_SQL} LIKE :prefix {LIKE_ESCAPE} OR {SEARCH_DOC_SQL} LIKE :word_prefix {LIKE_ESCAPE} THEN 1 ELSE 0 END AS rank "
+        f"FROM leads l WHERE {conds} "
+        f"ORDER BY rank DESC, l.id LIMIT :limit OFFSET :offset"
+    )
+
+
+def _sqlite_query(q: str, where: List[str]) -> str:
+    if len(q) >= MIN_TRIGRAM_LEN:
+        conds = " AND ".join(["leads_fts MATCH :match"] + where)
+        return (
+            "SELECT l.id, -bm25(leads_fts) AS rank FROM leads_fts JOIN leads l ON l.id = leads_fts.rowid "
+            f"WHERE {conds} ORDER BY rank DESC, l.id LIMIT :limit OFFSET :offset"
+        )
+    # Too short for trigrams: plain prefix match on each field
+    prefix = " OR ".join(f"lower(l.{f}) LIKE :prefix {LIKE_ESCAPE}" for f in SEARCH_FIELDS)
+    conds = " AND ".join([f"({prefix})"] + where)
+    return f"SELECT l.id, 0 AS rank FROM leads l WHERE {conds} ORDER BY l.id LIMIT :limit OFFSET :offset"
+
+
+async def search_leads(
+    db: AsyncSession,
+    q: str,
+    limit: int = 20,
+    offset: int = 0,
+    min_speed_web: Optional[int] = None,
+    max_speed_web: Optional[int] = None,
+    min_speed_mobile: Optional[int] = None,
+    max_speed_mobile: Optional[int] = None,
+    mail_sent: Optional[bool] = None,
+) -> List[tuple[LeadDB, float]]:
+    """Ranked (lead, score) matches for q over name, company, email, title and domain."""
+    q = re.sub(r"\s+", " ", q).strip().lower()
+    where, params = _filters(min_speed_web, max_speed_web, min_speed_mobile, max_speed_mobile, mail_sent, "l")
+    escaped = q.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    params.update(q=q, limit=limit, offset=offset, prefix=f"{escaped}%")
+
+    dialect = db.bind.dialect.name
+    if dialect == "postgresql":
+        await db.execute(text("SELECT set_config('pg_trgm.word_similarity_threshold', :t, true)"), {"t": str(FUZZY_THRESHOLD)})
+        params.update(pattern=f"%{escaped}%", word_prefix=f"% {escaped}%")
+        sql = _postgres_query(q, where)
+    elif dialect == "sqlite":
+        params["match"] = '"' + q.replace('"', '""') + '"'
+        sql = _sqlite_query(q, where)
+    else:
+        raise RuntimeError(f"Lead search is not supported on {dialect}")
+
+    ranked = (await db.execute(text(sql), params)).all()
+    if not ranked:
+        return []
+    leads = (await db.execute(select(LeadDB).where(LeadDB.id.in_([r.id for r in ranked])))).scalars().all()
+    by_id = {lead.id: lead for lead in leads}
+    return [(by_id[r.id], float(r.rank)) for r in ranked if r.id in by_id]
@@ -0,0 +1,113 @@
+# lead_stats.py
+import os
+import sys
+from collections import Counter
+from typing import Dict, Optional
+
+from sqlalchemy import event, func, case, select, update, delete, insert
+from sqlalchemy.orm import Session, attributes
+
+from database import SessionLocal, LeadDB, LeadStatDB
+
+# Counters behind /leads/stats. Every ORM flush that inserts, updates or deletes leads
+# adjusts them in the same transaction; bulk mapping writes call apply_deltas() themselves.
+SLOW_MOBILE_SCORE = int(os.getenv("SLOW_MOBILE_SCORE", "50"))
+
+TRACKED_COLUMNS = ("website_speed_web", "website_speed_mobile", "punchline1", "mail_sent")
+
+COUNTERS = {
+    "total": lambda r: True,
+    "tested": lambda r: r.get("website_speed_web") is not None or r.get("website_speed_mobile") is not None,
+    "slow_mobile": lambda r: r.get("website_speed_mobile") is not None and r["website_speed_mobile"] < SLOW_MOBILE_SCORE,
+    "with_punchlines": lambda r: bool(r.get("punchline1")),
+    "mailed": lambda r: bool(r.get("mail_sent")),
+}
+
+def counter_deltas(old: Optional[dict], new: Optional[dict]) -> Counter:
+    """Counter changes for one lead going from `old` to `new` (None = row absent)."""
+    deltas = Counter()
+    for name, matches in COUNTERS.items():
+        diff = int(new is not None and matches(new)) - int(old is not None and matches(old))
+        if diff:
+            deltas[name] += diff
+    return deltas
+
+def apply_deltas(conn, deltas: Dict[str, int]) -> None:
+    for name, diff in deltas.items():
+        if diff:
+            conn.execute(update(LeadStatDB).where(LeadStatDB.name == name).values(value=LeadStatDB.value + diff))
+
+# --- ORM hooks ---
+
+def _noop_set(target, value, oldvalue, initiator):
+    pass
+
+# active_history loads the old value on assignment, so history has it even if the attribute was expired
+for _col in TRACKED_COLUMNS:
+    event.listen(getattr(LeadDB, _col), "set", _noop_set, active_history=True)
+
+def _old_and_new(lead: LeadDB) -> tuple[dict, dict]:
+    old, new = {}, {}
+    for col in TRACKED_COLUMNS:
+        hist = attributes.get_history(lead, col)
+        before = hist.deleted[0] if hist.deleted else (hist.unchanged[0] if hist.unchanged else None)
+        old[col] = before
+        new[col] = hist.added[0] if hist.added else before
+    return old, new
+
+@event.listens_for(Session, "before_flush")
+def _track_lead_changes(session, flush_context, instances):
+    deltas = Counter()
+    for obj in session.new:
+        if isinstance(obj, LeadDB):
+            deltas.update(counter_deltas(None, _old_and_new(obj)[1]))
+    for obj in session.deleted:
+        if isinstance(obj, LeadDB):
+            deltas.update(counter_deltas(_old_and_new(obj)[0], None))
+    for obj in session.dirty:
+        if isinstance(obj, LeadDB) and session.is_modified(obj):
+            deltas.update(counter_deltas(*_old_and_new(obj)))
+    if any(deltas.values()):
+        apply_deltas(session.connection(), deltas)
+
+# --- Read / rebuild ---
+
+def rebuild(db: Session) -> Dict[str, int]:
+    """Recount everything with one scan of the leads table (the only full scan; use after manual SQL edits)."""
+    row = db.execute(select(
+        func.count(LeadDB.id).label("total"),
+        func.sum(case(((LeadDB.website_speed_web != None) | (LeadDB.website_speed_mobile != None), 1), else_=0)).label("tested"),
+        func.sum(case((LeadDB.website_speed_mobile < SLOW_MOBILE_SCORE, 1), else_=0)).label("slow_mobile"),
+        func.sum(case(((LeadDB.punchline1 != None) & (LeadDB.punchline1 != ""), 1), else_=0)).label("with_punchlines"),
+        func.sum(case((LeadDB.mail_sent == True, 1), else_=0)).label("mailed"),
+    )).one()
+    counts = {name: int(getattr(row, name) or 0) for name in COUNTERS}
+    db.execute(delete(LeadStatDB))
+    db.execute(insert(LeadStatDB), [{"name": k, "value": v} for k, v in counts.items()])
+    db.commit()
+    return counts
+
+def ensure_stats() -> None:
+    """Seed the counters on first start (or after new counters are added)."""
+    db = SessionLocal()
+    try:
+        have = {name for (name,) in db.query(LeadStatDB.name)}
+        if set(COUNTERS) - have:
+            print(f"[Stats] Rebuilt lead counters: {rebuild(db)}")
+    finally:
+        db.close()
+
+def read_stats(rows) -> Dict[str, int]:
+    stats = {name: 0 for name in COUNTERS}
+    stats.update({name: value for name, value in rows if name in stats})
+    return stats
+
+
+if __name__ == "__main__":
+    if sys.argv[1:] != ["rebuild"]:
+        sys.exit("usage: python lead_stats.py rebuild")
+    db = SessionLocal()
+    try:
+        print(rebuild(db))
+    finally:
+        db.close()
@@ -0,0 +1,131 @@
+# lead_upload.py
+from collections import Counter
+from sqlalchemy import tuple_
+from sqlalchemy.orm import Session
+
+from database import LeadDB
+from lead_cache import mark_leads_changed, mark_leads_updated
+from lead_stats import TRACKED_COLUMNS, counter_deltas, apply_deltas
+
+# Batch upsert behind /upload-csv (main.py runs it on the async connection via run_sync)
+
+
+def _lead_keys(rec: dict):
+    email = rec.get("email")
+    pair = (rec["company"], rec["website_url"]) if rec.get("company") and rec.get("website_url") else None
+    return email, pair
+
+
+def _prefetch_existing_leads(db: Session, payloads: list[dict]) -> list[dict]:
+    """Existing rows matching any email or (company, website_url) in the batch: one query per key type."""
+    emails = {p["email"] for p in payloads if p.get("email")}
+    pairs = {pair for pair in (_lead_keys(p)[1] for p in payloads) if pair}
+    cols = (LeadDB.id, LeadDB.email, LeadDB.company, LeadDB.website_url,
+            *(getattr(LeadDB, c) for c in TRACKED_COLUMNS))
+    found: dict[int, dict] = {}
+    if emails:
+        for r in db.query(*cols).filter(LeadDB.email.in_(emails)):
+            found[r.id] = dict(r._mapping)
+    if pairs:
+        for r in db.query(*cols).filter(tuple_(LeadDB.company, LeadDB.website_url).in_(list(pairs))):
+            found[r.id] = dict(r._mapping)
+    return list(found.values())
+
+
+def _upsert_rows_individually(db: Session, rows: list[tuple[int, dict]], errors: list[dict]) -> tuple[int, int]:
+    """Row-at-a-time fallback used when a bulk batch fails, so bad rows are reported individually."""
+    created = updated = 0
+    for i, payload in rows:
+        try:
+            email, pair = _lead_keys(payload)
+            existing = None
+            if email:
+                existing = db.query(LeadDB).filter(LeadDB.email == email).first()
+            if not existing and pair:
+                existing = db.query(LeadDB).filter(
+                    LeadDB.company == pair[0],
+                    LeadDB.website_url == pair[1]
+                ).first()
+
+            if existing:
+                for k, v in payload.items():
+                    if v not in (None, ""):
+                        setattr(existing, k, v)
+                db.commit()
+                updated += 1
+            else:
+                db.add(LeadDB(**payload))
+                db.commit()
+                created += 1
+        except Exception as e:
+            db.rollback()
+            errors.append({"row": i, "reason": str(e)})
+    return created, updated
+
+
+def upsert_lead_batch(db: Session, rows: list[tuple[int, dict]], errors: list[dict]) -> tuple[int, int]:
+    """
+    Upsert a batch of CSV payloads with one prefetch per key type and bulk insert/update.
+    Matching is the same as the row-by-row path: email first, then (company, website_url),
+    and rows later in the file see the ones before them. Returns (created, updated).
+    """
+    by_email: dict[str, dict] = {}
+    by_pair: dict[tuple, dict] = {}
+
+    def index(rec: dict):
+        email, pair = _lead_keys(rec)
+        if email:
+            by_email[email] = rec
+        if pair:
+            by_pair[pair] = rec
+
+    try:
+        existing: dict[int, dict] = {}
+        originals: dict[int, dict] = {}
+        for rec in _prefetch_existing_leads(db, [p for _, p in rows]):
+            existing[rec["id"]] = rec
+            originals[rec["id"]] = dict(rec)
+            index(rec)
+
+        inserts: list[dict] = []
+        updates: dict[int, dict] = {}
+        created = updated = 0
+        for _, payload in rows:
+            email, pair = _lead_keys(payload)
+            rec = by_email.get(email) if email else None
+            if rec is None and pair:
+                rec = by_pair.get(pair)
+
+            if rec is not None:
+                changes = {k: v for k, v in payload.items() if v not in (None, "")}
+                rec.update(changes)
+                if "id" in rec:  # existing row (pending inserts have no id yet)
+                    updates.setdefault(rec["id"], {"id": rec["id"]}).update(changes)
+                index(rec)
+                updated += 1
+            else:
+                rec = dict(payload)
+                inserts.append(rec)
+                index(rec)
+                created += 1
+
+        if inserts:
+            db.bulk_insert_mappings(LeadDB, inserts)
+        if updates:
+            db.bulk_update_mappings(LeadDB, list(updates.values()))
+        # Bulk mappings skip the ORM flush hooks, so adjust /leads/stats here
+        deltas = Counter()
+        for rec in inserts:
+            deltas.update(counter_deltas(None, rec))
+        for lead_id in updates:
+            deltas.update(counter_deltas(originals[lead_id], existing[lead_id]))
+        apply_deltas(db, deltas)
+        if inserts:
+            mark_leads_changed(db)
+        mark_leads_updated(db, updates)
+        db.commit()
+        return created, updated
+    except Exception as e:
+        db.rollback()
+        print(f"[upload-csv] Bulk batch failed ({e}); retrying {len(rows)} rows individually")
+        return _upsert_rows_individually(db, rows, errors)
@@ -9,6 +9,7 @@ from langchain.chains import LLMChain
 from langchain_core.output_parsers import StrOutputParser
 
 from database import SessionLocal, LeadDB
+from ghl_client import ghl
 from contextlib import contextmanager
 
 # NEW: shared LLM provider
@@ -17,7 +18,6 @@ from llm_provider import get_chat_groq
 # Load env for non-LLM settings used here (idempotent even if llm_provider already loaded it)
 load_dotenv()
 MAIL_SENDER = os.getenv("MAIL_SENDER")
-GHL_API_KEY = os.getenv("GOHIGHLEVEL_KEY")
 ENV = os.getenv("ENV", "prod")
 TEST_EMAIL = os.getenv("TEST_EMAIL", None)
 
@@ -115,7 +115,7 @@ def send_email_to_lead(lead_id: int, email_body: str) -> None:
         lead.final_email = email_body
         subject = lead.email_subject or f"Website performance improvements for {lead.company}"
 
-        send_url = "https://services.leadconnectorhq.com/conversations/messages"
+        send_url = "/conversations/messages"
 
         payload = {
             "type": "Email",
@@ -128,21 +128,17 @@ def send_email_to_lead(lead_id: int, email_body: str) -> None:
             "emailReplyMode": "reply"
         }
 
-        headers = {
-            "Authorization": f"Bearer {GHL_API_KEY}",
-            "Content-Type": "application/json",
-            "Accept": "application/json",
-            "Version": "2021-04-15"
-        }
+        # Auth comes from the shared client (ghl_client.py)
+        headers = {"Version": "2021-04-15"}
 
         try:
             print(f"Sending email to {recipient_email} via LeadConnector Conversations API...")
-            response = httpx.post(send_url, headers=headers, json=payload)
+            response = ghl.request_sync("POST", send_url, headers=headers, json=payload)
             response.raise_for_status()
             print("Email sent.")
 
             # Retry loop to get conversation ID
-            search_url = "https://services.leadconnectorhq.com/conversations/search"
+            search_url = "/conversations/search"
             search_params = {
                 "locationId": os.getenv("GOHIGHLEVEL_LOCATION_ID"),
                 "contactId": lead.ghl_contact_id
@@ -150,7 +146,7 @@ def send_email_to_lead(lead_id: int, email_body: str) -> None:
 
             conversation_id = None
             for attempt in range(5):
-                search_resp = httpx.get(search_url, headers=headers, params=search_params)
+                search_resp = ghl.request_sync("GET", search_url, location_id=search_params["locationId"], headers=headers, params=search_params)
                 print(search_params)
                 if search_resp.status_code == 200:
                     print(f"Search result: {search_resp.json()}")
@@ -2,11 +2,14 @@ from fastapi import FastAPI, Query, UploadFile, File, HTTPException, Request, De
 from fastapi.responses import FileResponse, JSONResponse, StreamingResponse
 from fastapi.exceptions import RequestValidationError
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.concurrency import run_in_threadpool
 from starlette.status import HTTP_422_UNPROCESSABLE_ENTITY
 from fastapi.staticfiles import StaticFiles
 from sqlalchemy.inspection import inspect
 from sqlalchemy.orm import Session
-from typing import List, Dict, Any, Optional
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import List, Dict, Any, Optional, Union
 import csv
 from io import StringIO
 import os
@@ -15,26 +18,53 @@ import re
 import json
 import datetime
 import io
+import base64
+from email.utils import formatdate, parsedate_to_datetime
+import asyncio
+from contextlib import asynccontextmanager
 from dotenv import load_dotenv
 from celery_worker import celery_app
 
 from auth.routes import router as auth_router
 from apollo import fetch_apollo_leads, get_person_details
-from models import Lead, MailBody
-from database import SessionLocal, LeadDB
+from models import Lead, LeadPage, LeadSearchPage, MailBody
+from database import SessionLocal, LeadDB, LeadStatDB, AsyncSessionLocal, get_async_db, init_db, dispose_engines, \
+    ReadSessionLocal, AsyncReadSessionLocal, get_read_db
 from pagespeed import test_all_unspeeded_leads, refresh_speed_for_lead
 from mail_gen import generate_email_from_lead, send_email_to_lead
 from pagespeed import get_pagespeed_score_and_screenshot
 from GoHighLevel import fetch_gohighlevel_leads
 from ghl_inbox import router as inbox_router
-from redis_cache import get_cached_lead_list, cache_lead_list
+from ghl_client import ghl
+from redis_cache import get_or_compute, get_many, lead_key, get_lead_versions, set_leads_if_current, lead_list_key, lead_page_key, get_lead_generation, get_lead_version, pubsub_client, \
+    run_invalidation_listener
+from lead_cache import wait_for_invalidations
 from scraping import scrape_and_extract  # Import scraping logic from scraping.py
-from punchline import generate_punchlines  
-from background_tasks import process_punchlines_for_lead, process_punchlines_for_all_leads
+from punchline import generate_punchlines, FALLBACK_LINE
+from punchline_index import get_punchline_index, DUP_THRESHOLD
+from lead_search import search_leads
+from lead_stats import ensure_stats, read_stats
+from lead_upload import upsert_lead_batch
+from background_tasks import punchline_pipeline, process_punchlines_for_all_leads
 from celery.result import AsyncResult
+from celery.states import READY_STATES
 from background_speedtest import run_bulk_speedtest_task
-
-app = FastAPI()
+from job_progress import get_progress, task_events_channel
+from job_ledger import get_job, outcome_counts, resume_blocker, set_status
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Schema sync runs once per API process at startup rather than on every import of database.py
+    await run_in_threadpool(init_db)
+    await run_in_threadpool(ensure_stats)
+    invalidation_listener = asyncio.create_task(run_invalidation_listener())
+    await ghl.start()
+    yield
+    invalidation_listener.cancel()
+    await ghl.aclose()
+    await dispose_engines()
+
+app = FastAPI(lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -53,20 +83,51 @@ def sanitize_domain(domain: str) -> str:
     return domain.replace(".", "_").replace(":", "_")
 
 
+# --- HTTP conditional requests ---
+
+def not_modified(request: Request, etag: str, last_modified: float) -> bool:
+    """True if the client's copy (If-None-Match, else If-Modified-Since) is still current."""
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        tags = {t.strip().removeprefix("W/") for t in if_none_match.split(",")}
+        return "*" in tags or etag.removeprefix("W/") in tags
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since and last_modified:
+        try:
+            return int(last_modified) <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+def validator_headers(etag: str, last_modified: float, cache_control: str) -> dict:
+    headers = {"ETag": etag, "Cache-Control": cache_control}
+    if last_modified:
+        headers["Last-Modified"] = formatdate(last_modified, usegmt=True)
+    return headers
+
+SCREENSHOT_IMMUTABLE_CACHE = "public, max-age=31536000, immutable"
+
 @app.get("/{domain}-{strategy}-pagespeed.png")
-async def get_screenshot(domain: str, strategy: str):
+async def get_screenshot(domain: str, strategy: str, request: Request, v: Optional[str] = None):
     # Sanitize the domain to match the file storage structure
     sanitized_domain = sanitize_domain(domain)
     
     # Construct the file path
     file_path = os.path.join(STATIC_DIR, sanitized_domain, f"{sanitized_domain}-{strategy}-pagespeed.png")
     
-    # Check if the file exists
-    if os.path.exists(file_path):
-        return FileResponse(file_path)
-    else:
+    # One stat() both checks the file exists and gives the validators
+    try:
+        st = os.stat(file_path)
+    except FileNotFoundError:
         raise HTTPException(status_code=404, detail="Screenshot not found")
 
+    # Versioned URLs (?v=, written by pagespeed) never change content; bare URLs must revalidate
+    etag = f'"{st.st_mtime_ns:x}-{st.st_size:x}"'
+    headers = validator_headers(etag, st.st_mtime, SCREENSHOT_IMMUTABLE_CACHE if v else "public, no-cache")
+    if not_modified(request, etag, st.st_mtime):
+        return Response(status_code=304, headers=headers)
+    return FileResponse(file_path, headers=headers, stat_result=st)
+
 
 # Mount the static files directory to serve other static files
 app.mount("/static", StaticFiles(directory=STATIC_DIR), name="static")
@@ -120,33 +181,144 @@ def root():
 
 
 
-@app.get("/leads", response_model=list[Lead])
-async def get_saved_leads(skip: int = 0, limit: int = 10):
+def encode_lead_cursor(after_id: int) -> str:
+    return base64.urlsafe_b64encode(json.dumps({"after_id": after_id}).encode()).decode().rstrip("=")
+
+def decode_lead_cursor(cursor: str) -> int:
     try:
-        # Try Redis first
-        cached = await get_cached_lead_list(skip, limit)
-        if cached:
-            print(f"Redis HIT for leads: skip={skip}, limit={limit}")
-            return cached
-        else:
-            print(f"Redis MISS for leads: skip={skip}, limit={limit}")
-
-        db: Session = SessionLocal()
-        db_leads = db.query(LeadDB) \
-            .filter(LeadDB.email != None, LeadDB.website_url != None) \
-            .order_by(LeadDB.id) \
-            .offset(skip) \
-            .limit(limit) \
-            .all()
-        db.close()
+        padded = cursor + "=" * (-len(cursor) % 4)
+        return int(json.loads(base64.urlsafe_b64decode(padded))["after_id"])
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+LEAD_ENTRY_TTL = int(os.getenv("LEAD_ENTRY_TTL", "300"))
+
+async def assemble_leads(ids: list[int]) -> list[dict]:
+    """Cached page ids -> lead dicts with one MGET; entries that dropped out are reloaded in one query."""
+    items = await get_many([lead_key(i) for i in ids])
+    missing = [i for i, item in zip(ids, items) if item is None]
+    if missing:
+        # Versions first, rows from the primary: a replica (or a read racing a commit) could
+        # return the pre-invalidation row, and the version check keeps that out of the cache
+        versions = await get_lead_versions(missing)
+        async with AsyncSessionLocal() as db:
+            result = await db.execute(select(LeadDB).where(LeadDB.id.in_(missing)))
+            loaded = [Lead.from_orm(l).dict() for l in result.scalars().all()]
+        if versions is not None:
+            by_id = dict(zip(missing, versions))
+            await set_leads_if_current(loaded, [by_id[item["id"]] for item in loaded], ttl=LEAD_ENTRY_TTL)
+        found = {item["id"]: item for item in loaded}
+        items = [item if item is not None else found.get(i) for i, item in zip(ids, items)]
+    return [item for item in items if item is not None]
+
+@app.get("/leads/stats")
+async def get_lead_stats():
+    """Dashboard counters from the lead_stats table (kept current on every lead write, see lead_stats.py)."""
+    async with AsyncReadSessionLocal() as db:
+        rows = (await db.execute(select(LeadStatDB.name, LeadStatDB.value))).all()
+    return read_stats(rows)
+
+@app.get("/leads/search", response_model=LeadSearchPage)
+async def search_saved_leads(
+    q: str = Query(..., min_length=1),
+    limit: int = Query(20, ge=1, le=100),
+    offset: int = Query(0, ge=0),
+    min_speed_web: Optional[int] = None,
+    max_speed_web: Optional[int] = None,
+    min_speed_mobile: Optional[int] = None,
+    max_speed_mobile: Optional[int] = None,
+    mail_sent: Optional[bool] = None
+):
+    """Prefix/fuzzy match over name, company, email, title and domain, best matches first."""
+    try:
+        async with AsyncReadSessionLocal() as db:
+            hits = await search_leads(
+                db, q, limit=limit, offset=offset,
+                min_speed_web=min_speed_web, max_speed_web=max_speed_web,
+                min_speed_mobile=min_speed_mobile, max_speed_mobile=max_speed_mobile,
+                mail_sent=mail_sent,
+            )
+    except Exception as e:
+        print(f"Error searching leads: {e}")
+        raise HTTPException(status_code=500, detail="Error searching leads")
+    items = [{**Lead.from_orm(lead).dict(), "score": round(score, 4)} for lead, score in hits]
+    return {"items": items, "next_offset": offset + limit if len(items) == limit else None}
+
+@app.get("/leads", response_model=Union[list[Lead], LeadPage])
+async def get_saved_leads(
+    request: Request,
+    response: Response,
+    skip: int = 0,
+    limit: int = 10,
+    after_id: Optional[int] = None,
+    cursor: Optional[str] = None
+):
+    """
+    Offset mode (skip/limit) returns a plain list, as before.
+    Keyset mode (after_id or an opaque cursor) returns {"items", "next_cursor"} and costs the same at any depth.
+    Both carry ETag/Last-Modified from the lead-table version and answer 304 while it is unchanged.
+    """
+    if cursor is not None:
+        after_id = decode_lead_cursor(cursor)
+
+    # Read the version before the data: a write in between only makes the next request refetch
+    lead_version = await get_lead_version()
+    if lead_version is not None:
+        version, modified_at = lead_version
+        etag = f'W/"leads-{version}-{skip}-{limit}-{after_id}"'
+        headers = validator_headers(etag, modified_at, "private, no-cache")
+        if not_modified(request, etag, modified_at):
+            return Response(status_code=304, headers=headers)
+        response.headers.update(headers)
+    else:
+        # Version unknown: always send the full page and don't let it be revalidated
+        response.headers["Cache-Control"] = "no-store"
+
+    if after_id is not None:
+        return await get_lead_page(after_id, limit)
+
+    async def load():
+        print(f"Redis MISS for leads: skip={skip}, limit={limit}")
+        async with AsyncReadSessionLocal() as db:
+            result = await db.execute(
+                select(LeadDB.id)
+                .where(LeadDB.email != None, LeadDB.website_url != None)
+                .order_by(LeadDB.id)
+                .offset(skip)
+                .limit(limit)
+            )
+            return list(result.scalars().all())
 
-        # Convert to serializable format
-        leads = [Lead.from_orm(l).dict() for l in db_leads]
+    try:
+        # Cached id list, or one loader per key while concurrent requests wait for it
+        gen = await get_lead_generation()
+        ids = await get_or_compute(lead_list_key(gen, skip, limit), load, ttl=300)
+        return await assemble_leads(ids)
 
-        # Cache the result
-        await cache_lead_list(skip, limit, leads, ttl=300)
+    except Exception as e:
+        print(f"Error fetching leads: {e}")
+        raise HTTPException(status_code=500, detail="Error fetching leads")
 
-        return leads
+async def get_lead_page(after_id: int, limit: int) -> dict:
+    async def load():
+        print(f"Redis MISS for leads: after_id={after_id}, limit={limit}")
+        async with AsyncReadSessionLocal() as db:
+            # Seeks by id (ix_leads_listable_id on Postgres, the rowid on SQLite) instead of scanning past skipped rows
+            result = await db.execute(
+                select(LeadDB.id)
+                .where(LeadDB.email != None, LeadDB.website_url != None, LeadDB.id > after_id)
+                .order_by(LeadDB.id)
+                .limit(limit)
+            )
+            ids = list(result.scalars().all())
+
+        next_cursor = encode_lead_cursor(ids[-1]) if len(ids) == limit else None
+        return {"ids": ids, "next_cursor": next_cursor}
+
+    try:
+        gen = await get_lead_generation()
+        page = await get_or_compute(lead_page_key(gen, after_id, limit), load, ttl=300)
+        return {"items": await assemble_leads(page["ids"]), "next_cursor": page["next_cursor"]}
 
     except Exception as e:
         print(f"Error fetching leads: {e}")
@@ -205,11 +377,13 @@ def get_db():
     finally:
         db.close()
 
+UPLOAD_BATCH_SIZE = int(os.getenv("UPLOAD_BATCH_SIZE", "500"))
+
 @app.post("/upload-csv")
 async def upload_csv_and_ingest(
     file: UploadFile = File(...),
     mapping: str = Form(...),     # JSON string with CSV->DB mapping
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     if not file.filename.lower().endswith(".csv"):
         raise HTTPException(status_code=400, detail="Invalid file type. Only CSV files are allowed.")
@@ -260,60 +434,38 @@ async def upload_csv_and_ingest(
 
     created = updated = 0
     errors: list[dict] = []
+    batch: list[tuple[int, dict]] = []
+
+    async def flush_batch():
+        nonlocal created, updated
+        if not batch:
+            return
+        # The batch upsert is sync ORM code; run_sync drives it on the async connection
+        c, u = await db.run_sync(upsert_lead_batch, batch, errors)
+        await wait_for_invalidations(db)
+        created += c
+        updated += u
+        batch.clear()
 
     for i, row in enumerate(reader, start=1):
-        try:
-            # Build payload from mapping
-            payload = {}
-            for db_field, csv_col in cleaned_map.items():
-                val = get_val(row, csv_col)
-                if db_field == "website_url":
-                    val = normalize_url(val)
-                payload[db_field] = val
-
-            email = payload.get("email")
-            company = payload.get("company")
-            website_url = payload.get("website_url")
-
-            # Must have at least email OR (company + website_url)
-            if not email and not (company and website_url):
-                errors.append({"row": i, "reason": "missing unique keys (email or company+website_url)"})
-                continue
-
-            # Upsert
-            existing = None
-            if email:
-                existing = db.query(LeadDB).filter(LeadDB.email == email).first()
-            if not existing and company and website_url:
-                existing = db.query(LeadDB).filter(
-                    LeadDB.company == company,
-                    LeadDB.website_url == website_url
-                ).first()
-
-            if existing:
-                for k, v in payload.items():
-                    if v not in (None, ""):
-                        setattr(existing, k, v)
-                updated += 1
-            else:
-                db.add(LeadDB(**payload))
-                created += 1
-
-            if (created + updated) % 100 == 0:
-                db.commit()
-
-        except Exception as e:
-            db.rollback()
-            errors.append({"row": i, "reason": str(e)})
+        # Build payload from mapping
+        payload = {}
+        for db_field, csv_col in cleaned_map.items():
+            val = get_val(row, csv_col)
+            if db_field == "website_url":
+                val = normalize_url(val)
+            payload[db_field] = val
+
+        # Must have at least email OR (company + website_url)
+        if not payload.get("email") and not (payload.get("company") and payload.get("website_url")):
+            errors.append({"row": i, "reason": "missing unique keys (email or company+website_url)"})
+            continue
 
-    db.commit()
+        batch.append((i, payload))
+        if len(batch) >= UPLOAD_BATCH_SIZE:
+            await flush_batch()
 
-    # Optional: clear a few cached pages if your cache_delete helper exists
-    try:
-        for skip in (0, 10, 20, 30, 40):
-            await cache_lead_list(skip, 10, None, ttl=0)
-    except Exception:
-        pass
+    await flush_batch()
 
     return {
         "filename": file.filename,
@@ -383,7 +535,7 @@ def download_leads_csv(
     response: Response,
     ids: Optional[List[int]] = Query(None, description="Filter by selected Lead IDs, e.g. ?ids=1&ids=2"),
     columns: Optional[str] = Query(None, description="Comma-separated list of columns to include"),
-    db: Session = Depends(get_db),
+    db: Session = Depends(get_read_db),
 ):
     export_cols = _resolve_export_columns(columns)
 
@@ -451,22 +603,126 @@ def send_mail(lead_id: int, body: MailBody):
 
 @app.post("/process-punchlines/{lead_id}")
 async def process_punchlines(lead_id: int):
-    task = process_punchlines_for_lead.delay(lead_id)
+    task = punchline_pipeline(lead_id, interactive=True).apply_async()
     return {"task_id": task.id, "message": "Punchline processing started in background."}
 
 @app.post("/process-punchlines")
-async def process_punchlines_all():
-    task = process_punchlines_for_all_leads.delay()
+async def process_punchlines_all(force: bool = False):
+    task = process_punchlines_for_all_leads.delay(force=force)
     return {"task_id": task.id, "message": "Bulk punchline processing started in background."}
 
+MAX_BATCH_TASK_IDS = 500
+
+def _jsonable_result(value):
+    return repr(value) if isinstance(value, BaseException) else value
+
+@app.post("/task-status")
+def get_task_statuses(task_ids: List[str] = Body(..., embed=True, description="Celery task ids to resolve")):
+    if len(task_ids) > MAX_BATCH_TASK_IDS:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BATCH_TASK_IDS} task ids per request")
+    backend = celery_app.backend
+    ids = list(dict.fromkeys(task_ids))
+    # One MGET for every result key instead of an AsyncResult round trip per id
+    values = backend.mget([backend.get_key_for_task(task_id) for task_id in ids]) if ids else []
+    statuses = {}
+    for task_id, value in zip(ids, values):
+        if value is None:
+            statuses[task_id] = {"status": "PENDING", "result": None}
+            continue
+        meta = backend.decode_result(value)
+        ready = meta["status"] in READY_STATES
+        statuses[task_id] = {
+            "status": meta["status"],
+            "result": _jsonable_result(meta.get("result")) if ready else None,
+        }
+    return {"tasks": statuses}
+
 @app.get("/task-status/{task_id}")
 def get_task_status(task_id: str):
     result = celery_app.AsyncResult(task_id)
-    return {"task_id": task_id, "status": result.status, "result": result.result if result.ready() else None}
+    # Fan-out jobs finish dispatching long before their subtasks; report their aggregate progress too
+    return {
+        "task_id": task_id,
+        "status": result.status,
+        "result": result.result if result.ready() else None,
+        "progress": get_progress(task_id),
+    }
+
+SSE_KEEPALIVE_SEC = 15
+
+def _task_snapshot(task_id: str) -> dict:
+    result = celery_app.AsyncResult(task_id)
+    progress = get_progress(task_id, include_failures=False)
+    final = progress.get("status") == "done" if progress else result.ready()
+    return {"event": "snapshot", "task_id": task_id, "state": result.status, "progress": progress, "final": final}
+
+def _sse(event: dict) -> str:
+    return f"event: {event.get('event', 'progress')}\ndata: {json.dumps(event)}\n\n"
+
+@app.get("/task-events/{task_id}")
+async def stream_task_events(task_id: str, request: Request):
+    async def event_stream():
+        pubsub = pubsub_client.pubsub()
+        # Subscribe before the snapshot so nothing published in between is missed
+        await pubsub.subscribe(task_events_channel(task_id))
+        try:
+            snapshot = await run_in_threadpool(_task_snapshot, task_id)
+            yield _sse(snapshot)
+            if snapshot["final"]:
+                return
+            while not await request.is_disconnected():
+                message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=SSE_KEEPALIVE_SEC)
+                if message is None:
+                    yield ": keep-alive\n\n"
+                    continue
+                event = json.loads(message["data"])
+                yield _sse(event)
+                if event.get("final"):
+                    return
+        finally:
+            await pubsub.unsubscribe()
+            await pubsub.aclose()
+
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    return StreamingResponse(event_stream(), media_type="text/event-stream", headers=headers)
+
+@app.get("/jobs/{job_id}")
+def get_bulk_job(job_id: str, db: Session = Depends(get_db)):
+    job = get_job(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return {
+        "job_id": job.id,
+        "kind": job.kind,
+        "status": job.status,
+        "params": job.params,
+        "last_lead_id": job.last_lead_id,
+        "outcomes": outcome_counts(db, job_id),
+        "progress": get_progress(job_id, include_failures=False),
+    }
+
+@app.post("/jobs/{job_id}/resume")
+def resume_bulk_job(job_id: str, force: bool = False):
+    job = get_job(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if job.kind not in ("punchlines", "speedtest"):
+        raise HTTPException(status_code=400, detail=f"Unknown job kind: {job.kind}")
+    # A second coordinator would re-dispatch every lead that has no outcome yet
+    blocker = None if force else resume_blocker(job_id)
+    if blocker:
+        raise HTTPException(status_code=409, detail=blocker)
+    set_status(job_id, "resuming")
+    if job.kind == "punchlines":
+        force = (job.params or {}).get("force", False)
+        task = process_punchlines_for_all_leads.delay(force=force, resume_job_id=job_id)
+    else:
+        task = run_bulk_speedtest_task.delay(resume_job_id=job_id)
+    return {"job_id": job_id, "task_id": task.id, "message": f"Resuming {job.kind} job from lead {job.last_lead_id}."}
 
 @app.get("/lead-punchlines/{lead_id}")
 def get_lead_punchlines(lead_id: int):
-    db = SessionLocal()
+    db = ReadSessionLocal()
     lead = db.query(LeadDB).filter(LeadDB.id == lead_id).first()
     if not lead:
         db.close()
@@ -479,11 +735,27 @@ def get_lead_punchlines(lead_id: int):
     db.close()
     return {"lead_id": lead_id, "punchlines": punchlines}
 
+@app.get("/punchlines/duplicates")
+def get_duplicate_punchlines(threshold: float = DUP_THRESHOLD, min_size: int = 2, limit: int = 50):
+    # Shared index, synced with the table so the report covers writes from every worker
+    index = get_punchline_index(skip_lines=[FALLBACK_LINE])
+    clusters, complete = index.clusters(min_size=min_size, threshold=threshold)
+    return {
+        "indexed": len(index),
+        "threshold": threshold,
+        "complete": complete,
+        "cluster_count": len(clusters),
+        "clusters": [
+            [{"lead_id": lead_id, "slot": f"punchline{slot}", "line": line} for (lead_id, slot), line in cluster]
+            for cluster in clusters[:limit]
+        ]
+    }
+
 @app.post("/download-csv-selected")
 def download_selected_leads_csv(
     lead_ids: List[int] = Body(..., embed=True, description="List of lead IDs to export"),
     columns: Optional[str] = None,
-    db: Session = Depends(get_db),
+    db: Session = Depends(get_read_db),
 ):
     export_cols = _resolve_export_columns(columns)
 
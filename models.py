@@ -1,4 +1,4 @@
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, List
 from pydantic import BaseModel
 
 class Lead(BaseModel):
@@ -32,5 +32,16 @@ class Lead(BaseModel):
         orm_mode = True
         from_attributes = True
 
+class LeadPage(BaseModel):
+    items: List[Lead]
+    next_cursor: Optional[str] = None
+
+class LeadSearchHit(Lead):
+    score: float
+
+class LeadSearchPage(BaseModel):
+    items: List[LeadSearchHit]
+    next_offset: Optional[int] = None
+
 class MailBody(BaseModel):
     email_body: str
\ No newline at end of file
@@ -5,10 +5,13 @@ from urllib.parse import urlparse
 from dotenv import load_dotenv
 from database import SessionLocal, LeadDB
 from sqlalchemy import or_, and_
+from job_progress import add_total, finish_dispatch
+from job_ledger import record_outcome, checkpoint, set_status, exclude_handled
 
 load_dotenv()
 GOOGLE_API_KEY = os.getenv("GOOGLE_PAGESPEED_KEY")
 STATIC_DIR = "static"
+SPEEDTEST_BATCH_SIZE = int(os.getenv("SPEEDTEST_BATCH_SIZE", "100"))
 
 
 def sanitize_domain(url: str) -> str:
@@ -80,7 +83,9 @@ def get_pagespeed_score_and_screenshot(url: str, strategy: str) -> tuple[dict |
 
             # Public URL structure without '/static/' prefix
             HF_SPACE_URL = "https://result.hellonotionhive.com"
-            screenshot_path = f"{HF_SPACE_URL}/{domain}-{strategy}-pagespeed.png"
+            # ?v= changes whenever the file is rewritten, so the URL can be cached as immutable
+            version = os.stat(filepath).st_mtime_ns // 1_000_000
+            screenshot_path = f"{HF_SPACE_URL}/{domain}-{strategy}-pagespeed.png?v={version}"
 
         return scores, screenshot_path, diagnostics_data, metrics_data
 
@@ -89,43 +94,68 @@ def get_pagespeed_score_and_screenshot(url: str, strategy: str) -> tuple[dict |
         return None, None, None, None
 
 
-def test_all_unspeeded_leads():
+def test_all_unspeeded_leads(job_id: str = None, resume: bool = False):
+    """
+    Test every lead in id order. With a job_id, each lead's outcome and the checkpoint
+    are written to the job ledger; resume=True skips leads that already have an outcome.
+    """
     db = SessionLocal()
     try:
-        leads = db.query(LeadDB).all()
+        query = exclude_handled(db.query(LeadDB), job_id if resume else None)
         count = 0
+        last_id = 0
 
         # (optional) quick visibility while validating
-        print(f"[/speedtest] candidates={len(leads)}")
-
-        for lead in leads:
-            # Desktop
-            scores_web, screenshot_web, _, metrics_web = get_pagespeed_score_and_screenshot(lead.website_url, "desktop")
-            # Mobile
-            scores_mob, screenshot_mob, diagnostics_mob, metrics_mob = get_pagespeed_score_and_screenshot(lead.website_url, "mobile")
-
-            # Save the data
-            if scores_web:
-                lead.website_speed_web = scores_web["performance"]
-            if scores_mob:
-                lead.website_speed_mobile = scores_mob["performance"]
-            if screenshot_web:
-                lead.screenshot_url_web = screenshot_web
-            if screenshot_mob:
-                lead.screenshot_url_mobile = screenshot_mob
-            if diagnostics_mob:
-                lead.pagespeed_diagnostics = diagnostics_mob
-            if metrics_web:
-                lead.pagespeed_metrics_desktop = metrics_web
-            if metrics_mob:
-                lead.pagespeed_metrics_mobile = metrics_mob
-
-            if scores_web or scores_mob:
-                db.commit()
-                count += 1
-                print(f"{lead.website_url} → W-{scores_web['performance'] if scores_web else '-'}, "
-                      f"M-{scores_mob['performance'] if scores_mob else '-'}")
-
+        candidates = query.count()
+        print(f"[/speedtest] candidates={candidates}")
+        if job_id:
+            add_total(job_id, candidates)
+            finish_dispatch(job_id)
+
+        # Keyset batches rather than .all(): commits below don't invalidate the cursor
+        while True:
+            batch = query.filter(LeadDB.id > last_id).order_by(LeadDB.id).limit(SPEEDTEST_BATCH_SIZE).all()
+            if not batch:
+                break
+
+            for lead in batch:
+                last_id = lead.id
+                # Desktop
+                scores_web, screenshot_web, _, metrics_web = get_pagespeed_score_and_screenshot(lead.website_url, "desktop")
+                # Mobile
+                scores_mob, screenshot_mob, diagnostics_mob, metrics_mob = get_pagespeed_score_and_screenshot(lead.website_url, "mobile")
+
+                # Save the data
+                if scores_web:
+                    lead.website_speed_web = scores_web["performance"]
+                if scores_mob:
+                    lead.website_speed_mobile = scores_mob["performance"]
+                if screenshot_web:
+                    lead.screenshot_url_web = screenshot_web
+                if screenshot_mob:
+                    lead.screenshot_url_mobile = screenshot_mob
+                if diagnostics_mob:
+                    lead.pagespeed_diagnostics = diagnostics_mob
+                if metrics_web:
+                    lead.pagespeed_metrics_desktop = metrics_web
+                if metrics_mob:
+                    lead.pagespeed_metrics_mobile = metrics_mob
+
+                if scores_web or scores_mob:
+                    db.commit()
+                    count += 1
+                    print(f"{lead.website_url} → W-{scores_web['performance'] if scores_web else '-'}, "
+                          f"M-{scores_mob['performance'] if scores_mob else '-'}")
+                    record_outcome(job_id, lead.id, "processed")
+                else:
+                    record_outcome(job_id, lead.id, "failed", "PageSpeed returned no scores")
+                if job_id:
+                    checkpoint(job_id, lead.id)
+
+            db.expunge_all()
+
+        if job_id:
+            set_status(job_id, "completed")
         return count
     finally:
         db.close()
@@ -1,6 +1,6 @@
 # punchline.py
 import os, re, json, argparse
-from typing import List, Tuple, Dict, Any
+from typing import List, Tuple, Dict, Any, Optional
 import random
 from dotenv import load_dotenv
 from llm_provider import get_chat_groq
@@ -14,6 +14,8 @@ load_dotenv()
 # -------------------------
 MAX_WORDS = int(os.environ.get("PUNCHLINE_MAX_WORDS", "35"))
 
+FALLBACK_LINE = "Couldn’t access website—manual review needed."
+
 PROVENANCE_NATURAL: Dict[str, List[str]] = {
     "home":  ["on your homepage", "in your main pitch", "right up front"],
     "about": ["on your About page", "in your story"],
@@ -238,7 +240,9 @@ def generate_punchlines(
     evidence: List[Any],
     k: int = 3,
     kinds: List[str] = None,
-    return_format: str = "list"  # "list" | "examples_block"
+    return_format: str = "list",  # "list" | "examples_block"
+    dedupe_index: Optional[Any] = None,  # punchline_index.PunchlineIndex
+    lead_id: Optional[int] = None
 ) -> Any:
     norm_evidence: List[Tuple[str, str]] = normalize_evidence(evidence)
     where_labels = where_labels_from_evidence(norm_evidence)
@@ -262,12 +266,17 @@ def generate_punchlines(
         if line and not line.endswith((".", "!", "?")):
             line += "."
         if passes_qc(line, snippets) and all(line.lower() != r.lower() for r in raw):
-            raw.append(line)
+            # Reject templated openers already stored for other leads
+            dupes = dedupe_index.query(line, exclude_lead=lead_id) if dedupe_index is not None else []
+            if dupes:
+                print(f"[Punchline] Rejected near-duplicate (sim={dupes[0][2]} vs lead {dupes[0][0][0]}): {line}")
+            else:
+                raw.append(line)
         i += 1
         time.sleep(10)
 
     while len(raw) < k:
-        raw.append("Couldn’t access website—manual review needed.")
+        raw.append(FALLBACK_LINE)
 
     scored = []
     for line in raw:
@@ -0,0 +1,272 @@
+# punchline_index.py
+import os
+import re
+import random
+import datetime
+import threading
+import zlib
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from database import SessionLocal, LeadDB
+
+# -------------------------
+# Config
+# -------------------------
+DUP_THRESHOLD = float(os.environ.get("PUNCHLINE_DUP_THRESHOLD", "0.6"))
+SHINGLE_SIZE = int(os.environ.get("PUNCHLINE_SHINGLE_SIZE", "3"))
+# Upper bound on Jaccard checks per duplicate report
+CLUSTER_MAX_COMPARISONS = int(os.environ.get("PUNCHLINE_CLUSTER_MAX_COMPARISONS", "500000"))
+# Incremental DB sync: re-read window behind the watermark
+SYNC_OVERLAP_SEC = int(os.environ.get("PUNCHLINE_SYNC_OVERLAP_SEC", "300"))
+
+# 16 bands x 4 rows puts the LSH knee around Jaccard 0.5, just under DUP_THRESHOLD,
+# so near-duplicates almost always share a bucket and candidates are then verified exactly.
+NUM_BANDS = 16
+ROWS_PER_BAND = 4
+NUM_PERM = NUM_BANDS * ROWS_PER_BAND
+
+_MERSENNE_PRIME = (1 << 61) - 1
+_MAX_HASH = (1 << 32) - 1
+
+# Fixed seed: signatures must be comparable across processes and restarts.
+_rng = random.Random(1729)
+_PERMUTATIONS = [
+    (_rng.randrange(1, _MERSENNE_PRIME), _rng.randrange(0, _MERSENNE_PRIME))
+    for _ in range(NUM_PERM)
+]
+
+PUNCHLINE_COLUMNS = ("punchline1", "punchline2", "punchline3")
+
+# (lead_id, slot) where slot is 1..3, matching punchline1..3
+EntryKey = Tuple[int, int]
+
+# -------------------------
+# Helpers
+# -------------------------
+def shingles(line: str, n: int = SHINGLE_SIZE) -> Set[str]:
+    toks = re.findall(r"\w+", (line or "").lower())
+    if not toks:
+        return set()
+    if len(toks) < n:
+        return {" ".join(toks)}
+    return {" ".join(toks[i:i+n]) for i in range(len(toks)-n+1)}
+
+def jaccard(a: Set[str], b: Set[str]) -> float:
+    if not a or not b:
+        return 0.0
+    return len(a & b) / float(len(a | b))
+
+def minhash(sh: Set[str]) -> Tuple[int, ...]:
+    hashes = [zlib.crc32(s.encode("utf-8")) & _MAX_HASH for s in sh]
+    return tuple(
+        min(((a * h + b) % _MERSENNE_PRIME) & _MAX_HASH for h in hashes)
+        for (a, b) in _PERMUTATIONS
+    )
+
+def _bands(signature: Tuple[int, ...]) -> List[Tuple[int, Tuple[int, ...]]]:
+    return [
+        (i, signature[i*ROWS_PER_BAND:(i+1)*ROWS_PER_BAND])
+        for i in range(NUM_BANDS)
+    ]
+
+# -------------------------
+# Index
+# -------------------------
+class PunchlineIndex:
+    """MinHash/LSH index over stored punchlines for near-duplicate lookup."""
+
+    def __init__(self, threshold: float = DUP_THRESHOLD):
+        self.threshold = threshold
+        self._entries: Dict[EntryKey, Tuple[str, Set[str], Tuple[int, ...]]] = {}
+        self._buckets: Dict[Tuple[int, Tuple[int, ...]], Set[EntryKey]] = {}
+        self._lock = threading.RLock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def add(self, key: EntryKey, line: str) -> None:
+        sh = shingles(line)
+        if not sh:
+            return
+        sig = minhash(sh)
+        with self._lock:
+            self.remove(key)
+            self._entries[key] = (line, sh, sig)
+            for band in _bands(sig):
+                self._buckets.setdefault(band, set()).add(key)
+
+    def remove(self, key: EntryKey) -> None:
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if not entry:
+                return
+            for band in _bands(entry[2]):
+                bucket = self._buckets.get(band)
+                if bucket:
+                    bucket.discard(key)
+                    if not bucket:
+                        del self._buckets[band]
+
+    def replace_lead(self, lead_id: int, lines: List[Optional[str]]) -> None:
+        """Swap a lead's indexed punchlines for the ones just saved."""
+        with self._lock:
+            for slot in range(1, len(PUNCHLINE_COLUMNS) + 1):
+                self.remove((lead_id, slot))
+            for slot, line in enumerate(lines, start=1):
+                if line:
+                    self.add((lead_id, slot), line)
+
+    def query(self, line: str, exclude_lead: Optional[int] = None, threshold: Optional[float] = None) -> List[Tuple[EntryKey, str, float]]:
+        """Return stored punchlines whose Jaccard similarity to `line` meets the threshold."""
+        threshold = self.threshold if threshold is None else threshold
+        sh = shingles(line)
+        if not sh:
+            return []
+        sig = minhash(sh)
+        with self._lock:
+            candidates: Set[EntryKey] = set()
+            for band in _bands(sig):
+                candidates |= self._buckets.get(band, set())
+            out = []
+            for key in candidates:
+                if exclude_lead is not None and key[0] == exclude_lead:
+                    continue
+                stored_line, stored_sh, _sig = self._entries[key]
+                sim = jaccard(sh, stored_sh)
+                if sim >= threshold:
+                    out.append((key, stored_line, round(sim, 3)))
+        out.sort(key=lambda x: x[2], reverse=True)
+        return out
+
+    def is_near_duplicate(self, line: str, exclude_lead: Optional[int] = None) -> bool:
+        return bool(self.query(line, exclude_lead=exclude_lead))
+
+    def clusters(self, min_size: int = 2, threshold: Optional[float] = None,
+                 max_comparisons: int = CLUSTER_MAX_COMPARISONS) -> Tuple[List[List[Tuple[EntryKey, str]]], bool]:
+        """
+        Group stored punchlines into near-duplicate clusters (union-find over LSH buckets).
+        Each bucket member is verified against one representative per cluster already seen in
+        that bucket, so a bucket full of one template costs linear, not quadratic, time.
+        Returns (clusters, complete); complete is False if max_comparisons ran out first.
+        """
+        threshold = self.threshold if threshold is None else threshold
+        comparisons = 0
+        complete = True
+        with self._lock:
+            parent: Dict[EntryKey, EntryKey] = {k: k for k in self._entries}
+
+            def find(k: EntryKey) -> EntryKey:
+                while parent[k] != k:
+                    parent[k] = parent[parent[k]]
+                    k = parent[k]
+                return k
+
+            for bucket in self._buckets.values():
+                if len(bucket) < 2:
+                    continue
+                reps: List[EntryKey] = []
+                for key in sorted(bucket):
+                    root = find(key)
+                    matched = False
+                    for rep in reps:
+                        if find(rep) == root:
+                            matched = True
+                            break
+                        if comparisons >= max_comparisons:
+                            complete = False
+                            break
+                        comparisons += 1
+                        if jaccard(self._entries[key][1], self._entries[rep][1]) >= threshold:
+                            parent[root] = find(rep)
+                            matched = True
+                            break
+                    if not complete:
+                        break
+                    if not matched:
+                        reps.append(key)
+                if not complete:
+                    break
+
+            groups: Dict[EntryKey, List[Tuple[EntryKey, str]]] = {}
+            for key, (line, _sh, _sig) in self._entries.items():
+                groups.setdefault(find(key), []).append((key, line))
+
+        out = [sorted(g) for g in groups.values() if len(g) >= min_size]
+        out.sort(key=len, reverse=True)
+        return out, complete
+
+# -------------------------
+# DB-backed index
+# -------------------------
+def iter_stored_punchlines(batch_size: int = 1000, since: Optional[datetime.datetime] = None) \
+        -> Iterable[Tuple[int, List[Optional[str]], Optional[datetime.datetime]]]:
+    """Yield (lead_id, [punchline1..3], punchlines_generated_at), optionally only rows generated since `since`."""
+    db = SessionLocal()
+    try:
+        rows = db.query(LeadDB.id, LeadDB.punchline1, LeadDB.punchline2, LeadDB.punchline3, LeadDB.punchlines_generated_at)
+        if since is None:
+            rows = rows.filter((LeadDB.punchline1 != None) | (LeadDB.punchline2 != None) | (LeadDB.punchline3 != None))
+        else:
+            rows = rows.filter(LeadDB.punchlines_generated_at >= since)
+        for lead_id, p1, p2, p3, generated_at in rows.yield_per(batch_size):
+            yield lead_id, [p1, p2, p3], generated_at
+    finally:
+        db.close()
+
+class SyncedPunchlineIndex(PunchlineIndex):
+    """
+    Index loaded from the leads table and refreshed incrementally (get_punchline_index syncs once
+    per generation), so lines saved by other workers/processes are seen. Rows are re-read from `synced_until` minus
+    SYNC_OVERLAP_SEC, which covers commits that land after a later timestamp was already seen.
+    """
+
+    def __init__(self, threshold: float = DUP_THRESHOLD, skip_lines: Iterable[str] = ()):
+        super().__init__(threshold=threshold)
+        self.skip = {s.lower() for s in skip_lines}
+        self.synced_until: Optional[datetime.datetime] = None
+        self._sync_lock = threading.Lock()
+
+    def _load(self, lead_id: int, lines: List[Optional[str]]) -> None:
+        self.replace_lead(lead_id, [None if not line or line.lower() in self.skip else line for line in lines])
+
+    def load_all(self) -> None:
+        with self._sync_lock:
+            for lead_id, lines, generated_at in iter_stored_punchlines():
+                self._load(lead_id, lines)
+                if generated_at and (self.synced_until is None or generated_at > self.synced_until):
+                    self.synced_until = generated_at
+
+    def sync(self) -> int:
+        """Pull punchlines generated since the last sync; returns how many leads were refreshed."""
+        with self._sync_lock:
+            since = None if self.synced_until is None else self.synced_until - datetime.timedelta(seconds=SYNC_OVERLAP_SEC)
+            refreshed = 0
+            try:
+                for lead_id, lines, generated_at in iter_stored_punchlines(since=since or datetime.datetime.min):
+                    self._load(lead_id, lines)
+                    refreshed += 1
+                    if generated_at and (self.synced_until is None or generated_at > self.synced_until):
+                        self.synced_until = generated_at
+            except Exception as e:
+                print(f"[PunchlineIndex] Sync failed, using cached index: {e}")
+            return refreshed
+
+def build_index_from_db(threshold: float = DUP_THRESHOLD, skip_lines: Iterable[str] = ()) -> SyncedPunchlineIndex:
+    index = SyncedPunchlineIndex(threshold=threshold, skip_lines=skip_lines)
+    index.load_all()
+    return index
+
+_index: Optional[SyncedPunchlineIndex] = None
+_index_lock = threading.Lock()
+
+def get_punchline_index(skip_lines: Iterable[str] = ()) -> SyncedPunchlineIndex:
+    """Process-wide index, loaded from the leads table on first use and synced with it on every call."""
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                _index = build_index_from_db(skip_lines=skip_lines)
+                print(f"[PunchlineIndex] Loaded {len(_index)} stored punchlines")
+                return _index
+    _index.sync()
+    return _index
@@ -1,6 +1,15 @@
 import os
-import json
+import time
+import math
+import random
+import uuid
+import zlib
+import orjson
+import asyncio
+from typing import Optional
+from collections import OrderedDict
 import redis.asyncio as redis
+import redis as sync_redis
 from urllib.parse import urlparse
 from dotenv import load_dotenv
 
@@ -18,52 +27,323 @@ parsed = urlparse(REDIS_URL)
 if not all([parsed.hostname, parsed.port, parsed.password]):
     raise RuntimeError("REDIS_URL is missing components. Check format: rediss://default:<token>@host:6379")
 
-redis_client = redis.Redis(
-    host=parsed.hostname,
-    port=int(parsed.port),
-    username=parsed.username,
-    password=parsed.password,
-    ssl=True,
-    decode_responses=True
-)
+# Bounded, reused TLS connections: callers wait for a free connection instead of opening more
+REDIS_MAX_CONNECTIONS = int(os.getenv("REDIS_MAX_CONNECTIONS", "50"))
+REDIS_POOL_TIMEOUT_SEC = float(os.getenv("REDIS_POOL_TIMEOUT_SEC", "5"))
+
+def _pool_kwargs(decode_responses: bool) -> dict:
+    return dict(
+        host=parsed.hostname,
+        port=int(parsed.port),
+        username=parsed.username,
+        password=parsed.password,
+        max_connections=REDIS_MAX_CONNECTIONS,
+        timeout=REDIS_POOL_TIMEOUT_SEC,
+        health_check_interval=30,
+        socket_keepalive=True,
+        decode_responses=decode_responses,
+    )
+
+# Text client: publishing, counters, progress hashes
+redis_client = redis.Redis(connection_pool=redis.BlockingConnectionPool(
+    connection_class=redis.SSLConnection, **_pool_kwargs(decode_responses=True)
+))
+
+# Pub/sub only: each subscriber (SSE stream, invalidation listener) holds a connection for
+# as long as it listens, so these get their own unbounded pool instead of starving redis_client
+_pubsub_kwargs = {k: v for k, v in _pool_kwargs(decode_responses=True).items() if k not in ("max_connections", "timeout")}
+pubsub_client = redis.Redis(connection_pool=redis.ConnectionPool(
+    connection_class=redis.SSLConnection, **_pubsub_kwargs
+))
+
+# Binary client for cache payloads (see encode_value/decode_value)
+cache_client = redis.Redis(connection_pool=redis.BlockingConnectionPool(
+    connection_class=redis.SSLConnection, **_pool_kwargs(decode_responses=False)
+))
+
+# Blocking client for Celery tasks and other sync code paths
+sync_redis_client = sync_redis.Redis(connection_pool=sync_redis.BlockingConnectionPool(
+    connection_class=sync_redis.SSLConnection, **_pool_kwargs(decode_responses=True)
+))
+
+# --- Cache codec ---
+# orjson, zlib-compressed above CACHE_COMPRESS_MIN_BYTES. A one-byte prefix says which;
+# values without one were written by the old stdlib-json code and are still readable.
+
+CACHE_COMPRESS_MIN_BYTES = int(os.getenv("CACHE_COMPRESS_MIN_BYTES", "1024"))
+CACHE_COMPRESS_LEVEL = int(os.getenv("CACHE_COMPRESS_LEVEL", "3"))
+_RAW, _ZLIB = b"\x00", b"\x01"
+
+def encode_value(value) -> bytes:
+    data = orjson.dumps(value)
+    if len(data) >= CACHE_COMPRESS_MIN_BYTES:
+        return _ZLIB + zlib.compress(data, CACHE_COMPRESS_LEVEL)
+    return _RAW + data
+
+def decode_value(blob: bytes):
+    marker, body = blob[:1], blob[1:]
+    if marker == _ZLIB:
+        return orjson.loads(zlib.decompress(body))
+    if marker == _RAW:
+        return orjson.loads(body)
+    return orjson.loads(blob)
+
+# --- In-process cache (first tier) ---
+# Decoded values are kept per process for a few seconds in front of Redis. Writers publish the
+# key on INVALIDATION_CHANNEL and every API process drops its copy (run_invalidation_listener).
+# Values handed out are shared between requests: callers must not mutate them.
+
+LOCAL_CACHE_TTL_SEC = float(os.getenv("LOCAL_CACHE_TTL_SEC", "5"))
+LOCAL_CACHE_MAX_ENTRIES = int(os.getenv("LOCAL_CACHE_MAX_ENTRIES", "1024"))
+INVALIDATION_CHANNEL = "cache-invalidate"
+
+class LocalCache:
+    """TTL + LRU dict; only touched from the event loop thread, so no locking."""
+
+    def __init__(self, max_entries: int = LOCAL_CACHE_MAX_ENTRIES, ttl: float = LOCAL_CACHE_TTL_SEC):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._data: "OrderedDict[str, tuple[float, object]]" = OrderedDict()
+
+    def get(self, key: str):
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self._data[key]
+            return None
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key: str, value, ttl: float = None) -> None:
+        if self.max_entries <= 0 or value is None:
+            return
+        self._data[key] = (time.monotonic() + min(ttl or self.ttl, self.ttl), value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_entries:
+            self._data.popitem(last=False)
+
+    def invalidate(self, key: str) -> None:
+        self._data.pop(key, None)
+
+    def clear(self) -> None:
+        self._data.clear()
+
+local_cache = LocalCache()
+
+async def _publish_invalidation(key: str) -> None:
+    local_cache.invalidate(key)
+    try:
+        await redis_client.publish(INVALIDATION_CHANNEL, key)
+    except Exception as e:
+        print(f"[Redis] Error publishing invalidation for {key}: {e}")
+
+async def run_invalidation_listener() -> None:
+    """Drop local entries other processes changed; started from the FastAPI lifespan."""
+    while True:
+        pubsub = pubsub_client.pubsub()
+        try:
+            await pubsub.subscribe(INVALIDATION_CHANNEL)
+            # Anything published while we weren't subscribed is lost, so start clean
+            local_cache.clear()
+            async for message in pubsub.listen():
+                if message["type"] == "message":
+                    local_cache.invalidate(message["data"])
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"[Redis] Invalidation listener error, resubscribing: {e}")
+            local_cache.clear()
+            await asyncio.sleep(1)
+        finally:
+            await pubsub.aclose()
 
 # --- Base Utility Functions ---
 
 async def set_cache(key: str, value, ttl: int = None):
     """Set a value in Redis with optional TTL (in seconds)."""
     try:
-        serialized = json.dumps(value)
+        serialized = encode_value(value)
         if ttl:
-            await redis_client.setex(key, ttl, serialized)
+            await cache_client.setex(key, ttl, serialized)
         else:
-            await redis_client.set(key, serialized)
+            await cache_client.set(key, serialized)
     except Exception as e:
         print(f"[Redis] Error setting cache for {key}: {e}")
+        return
+    await _publish_invalidation(key)
+    local_cache.set(key, value, ttl)
 
 async def get_cache(key: str):
-    """Retrieve and deserialize value from Redis."""
+    """Retrieve and deserialize value, from this process's copy if it is still fresh."""
+    value = local_cache.get(key)
+    if value is not None:
+        return value
     try:
-        cached = await redis_client.get(key)
+        cached = await cache_client.get(key)
         if cached:
-            return json.loads(cached)
+            value = decode_value(cached)
+            local_cache.set(key, value)
+            return value
     except Exception as e:
         print(f"[Redis] Error getting cache for {key}: {e}")
     return None
 
+async def get_many(keys: list[str]) -> list:
+    """Values for keys in order (None where missing), with one MGET for whatever isn't held locally."""
+    values = [local_cache.get(k) for k in keys]
+    missing = [i for i, v in enumerate(values) if v is None]
+    if not missing:
+        return values
+    try:
+        blobs = await cache_client.mget([keys[i] for i in missing])
+    except Exception as e:
+        print(f"[Redis] Error getting {len(missing)} cache keys: {e}")
+        return values
+    for i, blob in zip(missing, blobs):
+        if blob:
+            try:
+                values[i] = decode_value(blob)
+                local_cache.set(keys[i], values[i])
+            except Exception as e:
+                print(f"[Redis] Error decoding cache for {keys[i]}: {e}")
+    return values
+
+async def set_many(items: dict, ttl: int = None):
+    """Write several entries in one pipelined round trip."""
+    if not items:
+        return
+    try:
+        pipe = cache_client.pipeline(transaction=False)
+        for key, value in items.items():
+            if ttl:
+                pipe.setex(key, ttl, encode_value(value))
+            else:
+                pipe.set(key, encode_value(value))
+        await pipe.execute()
+    except Exception as e:
+        print(f"[Redis] Error setting {len(items)} cache keys: {e}")
+        return
+    try:
+        pipe = redis_client.pipeline(transaction=False)
+        for key in items:
+            local_cache.invalidate(key)
+            pipe.publish(INVALIDATION_CHANNEL, key)
+        await pipe.execute()
+    except Exception as e:
+        print(f"[Redis] Error publishing invalidations: {e}")
+    for key, value in items.items():
+        local_cache.set(key, value, ttl)
+
 async def delete_cache(key: str):
     """Delete a cache entry."""
     try:
-        await redis_client.delete(key)
+        await cache_client.delete(key)
     except Exception as e:
         print(f"[Redis] Error deleting cache for {key}: {e}")
+    await _publish_invalidation(key)
 
-# --- Inbox (conversation list) Caching ---
+# --- Single-flight compute ---
+# get_or_compute() lets one caller per key rebuild an entry: other callers in this process await
+# the same future, callers in other processes see the Redis lock and serve the old value (or wait
+# for the new one). Entries also carry their compute time, and each read may volunteer to refresh
+# early with probability rising towards expiry (XFetch), so hot keys rarely expire under load.
+
+XFETCH_BETA = float(os.getenv("CACHE_XFETCH_BETA", "1.0"))
+RECOMPUTE_LOCK_MS = int(os.getenv("CACHE_RECOMPUTE_LOCK_MS", "10000"))
+_LOCK_POLL_SEC = 0.05
+_RELEASE_LOCK = "if redis.call('get', KEYS[1]) == ARGV[1] then return redis.call('del', KEYS[1]) end return 0"
+
+_inflight: dict = {}
+
+async def _get_envelope(key: str):
+    env = local_cache.get(key)
+    if env is not None:
+        return env
+    try:
+        blob = await cache_client.get(key)
+        if blob:
+            env = decode_value(blob)
+            if not isinstance(env, dict) or "e" not in env:
+                return None  # plain set_cache value from before this key used get_or_compute
+            local_cache.set(key, env, max(env["e"] - time.time(), 0))
+            return env
+    except Exception as e:
+        print(f"[Redis] Error getting cache for {key}: {e}")
+    return None
 
-async def cache_inbox(key: str, inbox_data: list, ttl: int = 120):
-    await set_cache(key, inbox_data, ttl)
+def _should_refresh(env: dict, beta: float) -> bool:
+    # XFetch: now - delta * beta * ln(rand) >= expiry (ln(rand) <= 0, so this moves "now" forward)
+    return time.time() - env["d"] * beta * math.log(random.random() or 1e-12) >= env["e"]
 
-async def get_cached_inbox(key: str):
-    return await get_cache(key)
+async def _compute_and_store(key: str, compute, ttl: int):
+    start = time.time()
+    value = await compute()
+    env = {"v": value, "d": time.time() - start, "e": time.time() + ttl}
+    await set_cache(key, env, ttl)
+    return value
+
+async def _wait_for_fill(key: str):
+    deadline = time.monotonic() + RECOMPUTE_LOCK_MS / 1000
+    while time.monotonic() < deadline:
+        await asyncio.sleep(_LOCK_POLL_SEC)
+        env = await _get_envelope(key)
+        if env is not None:
+            return env
+    return None
+
+async def _recompute(key: str, compute, ttl: int, stale):
+    lock_key, token = f"lock:{key}", uuid.uuid4().hex
+    try:
+        locked = await cache_client.set(lock_key, token, nx=True, px=RECOMPUTE_LOCK_MS)
+    except Exception as e:
+        print(f"[Redis] Error taking recompute lock for {key}: {e}")
+        locked = True  # Redis trouble: just compute
+    if not locked:
+        # Another process is on it
+        if stale is not None:
+            return stale["v"]
+        env = await _wait_for_fill(key)
+        if env is not None:
+            return env["v"]
+        return await _compute_and_store(key, compute, ttl)
+    try:
+        return await _compute_and_store(key, compute, ttl)
+    finally:
+        try:
+            await cache_client.eval(_RELEASE_LOCK, 1, lock_key, token)
+        except Exception as e:
+            print(f"[Redis] Error releasing recompute lock for {key}: {e}")
+
+async def get_or_compute(key: str, compute, ttl: int, beta: float = XFETCH_BETA):
+    """
+    Cached value for key, or `await compute()` stored for ttl seconds, with at most one
+    recompute per key at a time. Entries are envelopes; read them only through this function.
+    """
+    env = await _get_envelope(key)
+    if env is not None and not _should_refresh(env, beta):
+        return env["v"]
+    inflight = _inflight.get(key)
+    if inflight is not None:
+        return env["v"] if env is not None else await asyncio.shield(inflight)
+
+    fut = asyncio.get_running_loop().create_future()
+    fut.add_done_callback(lambda f: f.cancelled() or f.exception())  # no "never retrieved" noise
+    _inflight[key] = fut
+    try:
+        value = await _recompute(key, compute, ttl, env)
+        fut.set_result(value)
+        return value
+    except BaseException as e:
+        fut.set_exception(e)
+        raise
+    finally:
+        _inflight.pop(key, None)
+
+# --- Inbox (conversation list) Caching ---
+
+# Inbox lists are filled through get_or_compute (see ghl_inbox.get_inbox_conversations)
 
 async def invalidate_inbox(key: str):
     await delete_cache(key)
@@ -80,17 +360,138 @@ async def get_cached_conversation(convo_id: str):
 async def invalidate_conversation(convo_id: str):
     await delete_cache(f"inbox:conversation:{convo_id}")
 
+# Cleaned message bodies never change once sent, so they are kept much longer than threads
+
+MESSAGE_BODY_TTL = 7 * 24 * 3600
+
+async def get_cached_message_bodies(message_ids: list[str]) -> dict:
+    """{message_id: cleaned body} for the ids already cached (one MGET)."""
+    bodies = await get_many([f"inbox:message:{m}" for m in message_ids])
+    return {m: body for m, body in zip(message_ids, bodies) if body is not None}
+
+async def cache_message_bodies(bodies: dict, ttl: int = MESSAGE_BODY_TTL):
+    await set_many({f"inbox:message:{m}": body for m, body in bodies.items()}, ttl)
+
 
 # --- Lead List Caching ---
+# Each lead is cached once under lead_key(id); list/page entries hold only ids and are
+# assembled with one MGET. A write to a lead bumps its lead-ver:{id} and drops its entry;
+# refills are compare-and-set against the version read before loading. Writes that can change
+# which leads a page holds (insert, delete, email/website_url edits) bump LEAD_GEN_KEY,
+# which every page key embeds, so all id lists become unreachable at once and expire by TTL.
+# Read the generation before querying the database and cache under that same value, so a
+# write that lands mid-query leaves the new entry already stale rather than wrongly fresh.
+
+LEAD_GEN_KEY = "leads:gen"
+# Bumped on every lead write (membership or not); validator for HTTP ETag/Last-Modified on lists
+LEAD_VERSION_KEY = "leads:version"
+LEAD_MODIFIED_KEY = "leads:modified_at"
+
+async def get_lead_generation() -> str:
+    gen = local_cache.get(LEAD_GEN_KEY)
+    if gen is not None:
+        return gen
+    try:
+        gen = await redis_client.get(LEAD_GEN_KEY) or "0"
+    except Exception as e:
+        print(f"[Redis] Error reading {LEAD_GEN_KEY}: {e}")
+        return "0"
+    local_cache.set(LEAD_GEN_KEY, gen)
+    return gen
+
+async def get_lead_version() -> Optional[tuple[str, float]]:
+    """(version, unix time of the last lead write), or None if Redis can't say."""
+    cached = local_cache.get(LEAD_VERSION_KEY)
+    if cached is not None:
+        return cached
+    try:
+        version, modified_at = await redis_client.mget(LEAD_VERSION_KEY, LEAD_MODIFIED_KEY)
+    except Exception as e:
+        print(f"[Redis] Error reading {LEAD_VERSION_KEY}: {e}")
+        # Not ("0", 0.0): that would hand out an ETag clients could later match against a stale page
+        return None
+    cached = (version or "0", float(modified_at or 0))
+    local_cache.set(LEAD_VERSION_KEY, cached)
+    return cached
+
+def lead_key(lead_id: int) -> str:
+    return f"lead:{lead_id}"
+
+def lead_version_key(lead_id: int) -> str:
+    return f"lead-ver:{lead_id}"
+
+# KEYS: (lead:{id}, lead-ver:{id}) pairs; ARGV: ttl, then (version read before loading, value) pairs.
+# An entry is written only if no invalidation bumped the lead's version since it was read.
+_SET_IF_CURRENT = """
+local written = {}
+for j = 0, #KEYS / 2 - 1 do
+  if (redis.call('get', KEYS[2 * j + 2]) or '0') == ARGV[2 * j + 2] then
+    redis.call('set', KEYS[2 * j + 1], ARGV[2 * j + 3], 'EX', ARGV[1])
+    table.insert(written, j)
+  end
+end
+return written
+"""
+
+async def get_lead_versions(lead_ids: list[int]) -> Optional[list[str]]:
+    """Per-lead versions to pass to set_leads_if_current; read them before loading the rows. None if Redis is down."""
+    if not lead_ids:
+        return []
+    try:
+        versions = await redis_client.mget([lead_version_key(i) for i in lead_ids])
+    except Exception as e:
+        print(f"[Redis] Error reading lead versions: {e}")
+        return None
+    return [v or "0" for v in versions]
 
-async def cache_lead_list(skip: int, limit: int, leads: list, ttl: int = 300):
-    key = f"leads:list:skip={skip}:limit={limit}"
-    await set_cache(key, leads, ttl)
+async def set_leads_if_current(items: list[dict], versions: list[str], ttl: int) -> None:
+    """Refill lead:{id} entries, skipping any lead invalidated after its version was read."""
+    if not items:
+        return
+    keys, args = [], [ttl]
+    for item, version in zip(items, versions):
+        keys += [lead_key(item["id"]), lead_version_key(item["id"])]
+        args += [version, encode_value(item)]
+    try:
+        written = await cache_client.eval(_SET_IF_CURRENT, len(keys), *keys, *args)
+    except Exception as e:
+        print(f"[Redis] Error refilling {len(items)} lead entries: {e}")
+        return
+    for j in written:
+        local_cache.set(lead_key(items[j]["id"]), items[j], ttl)
+
+def _queue_lead_invalidation(pipe, lead_ids, membership_changed: bool) -> None:
+    pipe.incr(LEAD_VERSION_KEY)
+    pipe.set(LEAD_MODIFIED_KEY, time.time())
+    pipe.publish(INVALIDATION_CHANNEL, LEAD_VERSION_KEY)
+    if membership_changed:
+        pipe.incr(LEAD_GEN_KEY)
+        pipe.publish(INVALIDATION_CHANNEL, LEAD_GEN_KEY)
+    for lead_id in lead_ids:
+        pipe.incr(lead_version_key(lead_id))
+        pipe.delete(lead_key(lead_id))
+        pipe.publish(INVALIDATION_CHANNEL, lead_key(lead_id))
+
+def invalidate_leads(lead_ids, membership_changed: bool) -> None:
+    """Blocking, for sync code (ORM hooks, Celery tasks): one pipelined round trip; API processes drop local copies."""
+    try:
+        pipe = sync_redis_client.pipeline()
+        _queue_lead_invalidation(pipe, lead_ids, membership_changed)
+        pipe.execute()
+    except Exception as e:
+        print(f"[Redis] Error invalidating cached leads: {e}")
+
+async def ainvalidate_leads(lead_ids, membership_changed: bool) -> None:
+    """invalidate_leads for code running on the event loop (commits through an AsyncSession)."""
+    try:
+        pipe = redis_client.pipeline()
+        _queue_lead_invalidation(pipe, lead_ids, membership_changed)
+        await pipe.execute()
+    except Exception as e:
+        print(f"[Redis] Error invalidating cached leads: {e}")
 
-async def get_cached_lead_list(skip: int, limit: int):
-    key = f"leads:list:skip={skip}:limit={limit}"
-    return await get_cache(key)
+def lead_list_key(gen: str, skip: int, limit: int) -> str:
+    return f"leads:list-ids:gen={gen}:skip={skip}:limit={limit}"
 
-async def invalidate_lead_list(skip: int, limit: int):
-    key = f"leads:list:skip={skip}:limit={limit}"
-    await delete_cache(key)
\ No newline at end of file
+def lead_page_key(gen: str, after_id: int, limit: int) -> str:
+    return f"leads:page-ids:gen={gen}:after={after_id}:limit={limit}"
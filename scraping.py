@@ -1,11 +1,13 @@
 import os
 import re
 import json
+import hashlib
 import time
 import random
 from dataclasses import dataclass
-from typing import List, Optional, Tuple, Dict
+from typing import List, Optional, Tuple, Dict, Callable, Awaitable
 import requests
+import httpx
 import tldextract
 from playwright.async_api import async_playwright
 
@@ -71,7 +73,7 @@ class FirecrawlClient:
         self.api_key = api_key
         self.crawl_path = crawl_path if crawl_path.startswith("/") else "/" + crawl_path
 
-    def crawl(self, root_url: str, follow_paths: List[str], max_pages: int = MAX_PAGES_PER_DOMAIN, timeout_sec: int = 25) -> Dict[str, str]:
+    def _request(self, root_url: str, follow_paths: List[str], max_pages: int, timeout_sec: int) -> Tuple[str, Dict[str, str], dict]:
         headers = {"Content-Type": "application/json"}
         if self.api_key:
             headers["Authorization"] = f"Bearer {self.api_key}"
@@ -83,14 +85,10 @@ class FirecrawlClient:
             "returnFormat": "markdown",
             "timeout": timeout_sec * 1000
         }
-        endpoint = f"{self.base_url}{self.crawl_path}"
-        try:
-            resp = requests.post(endpoint, headers=headers, data=json.dumps(payload), timeout=timeout_sec+5)
-            resp.raise_for_status()
-            data = resp.json()
-        except Exception as e:
-            return {"__error__": f"firecrawl_error: {e}"}
+        return f"{self.base_url}{self.crawl_path}", headers, payload
 
+    @staticmethod
+    def _parse(data, root_url: str) -> Dict[str, str]:
         out, pages = {}, []
         if isinstance(data, dict):
             if "pages" in data: pages = data["pages"]
@@ -104,8 +102,29 @@ class FirecrawlClient:
         if not out: out["__error__"] = "firecrawl_no_pages_returned"
         return out
 
+    def crawl(self, root_url: str, follow_paths: List[str], max_pages: int = MAX_PAGES_PER_DOMAIN, timeout_sec: int = 25) -> Dict[str, str]:
+        endpoint, headers, payload = self._request(root_url, follow_paths, max_pages, timeout_sec)
+        try:
+            resp = requests.post(endpoint, headers=headers, data=json.dumps(payload), timeout=timeout_sec+5)
+            resp.raise_for_status()
+            data = resp.json()
+        except Exception as e:
+            return {"__error__": f"firecrawl_error: {e}"}
+        return self._parse(data, root_url)
+
+    async def acrawl(self, client: httpx.AsyncClient, root_url: str, follow_paths: List[str], max_pages: int = MAX_PAGES_PER_DOMAIN, timeout_sec: int = 25) -> Dict[str, str]:
+        """Same as crawl(), over a caller-owned pooled async client."""
+        endpoint, headers, payload = self._request(root_url, follow_paths, max_pages, timeout_sec)
+        try:
+            resp = await client.post(endpoint, headers=headers, json=payload, timeout=timeout_sec+5)
+            resp.raise_for_status()
+            data = resp.json()
+        except Exception as e:
+            return {"__error__": f"firecrawl_error: {e}"}
+        return self._parse(data, root_url)
+
 # ---------- Playwright fallback ----------
-async def playwright_scrape_bundle(root_url: str, follow_paths: List[str]) -> Dict[str, str]:
+async def playwright_scrape_bundle(root_url: str, follow_paths: List[str], browser=None) -> Dict[str, str]:
     def should_visit(candidate: str, root: str) -> bool:
         if not candidate.startswith(root): return False
         path = candidate[len(root):]
@@ -113,45 +132,56 @@ async def playwright_scrape_bundle(root_url: str, follow_paths: List[str]) -> Di
     
     extracted = {}
     
-    # Use async_playwright instead of sync_playwright
-    async with async_playwright() as p:
-        browser = await p.chromium.launch(headless=True)
+    async def scrape_with(browser) -> None:
         ctx = await browser.new_context(user_agent="Mozilla/5.0")
-        page = await ctx.new_page()
+        try:
+            page = await ctx.new_page()
+
+            async def visit(u: str):
+                try:
+                    await page.goto(u, timeout=PLAYWRIGHT_TIMEOUT_MS, wait_until="load")
+                except Exception:
+                    try: 
+                        await page.goto(u, timeout=PLAYWRIGHT_TIMEOUT_MS, wait_until="domcontentloaded")
+                    except Exception as e:
+                        extracted[u] = f"__error__: {e}"; return
+                txt = await page.evaluate("""
+                    () => {
+                        function visible(el) { const s = window.getComputedStyle(el); return s && s.visibility !== 'hidden' && s.display !== 'none'; }
+                        const blocks = []; const w = document.createTreeWalker(document.body, NodeFilter.SHOW_TEXT, null);
+                        let n; while ((n = w.nextNode())) { const t = n.nodeValue.replace(/\\s+/g, ' ').trim(); if (t && visible(n.parentElement)) blocks.push(t); }
+                        const h = [...document.querySelectorAll('h1,h2,h3')].map(e => e.innerText.trim());
+                        return h.join('\\n') + '\\n' + blocks.join('\\n');
+                    }
+                """)
+                extracted[u] = txt or ""
+        
+            root = normalize_url(root_url)
+            await visit(root)
         
-        async def visit(u: str):
             try:
-                await page.goto(u, timeout=PLAYWRIGHT_TIMEOUT_MS, wait_until="load")
+                links = await page.eval_on_selector_all("a[href]", "els => els.map(e => e.href)")
+                links = [normalize_url(l) for l in links if l]
+                links = unique_lines([l for l in links if should_visit(l, root)])
+                for l in links[:MAX_PAGES_PER_DOMAIN-1]:
+                    await visit(l)
             except Exception:
-                try: 
-                    await page.goto(u, timeout=PLAYWRIGHT_TIMEOUT_MS, wait_until="domcontentloaded")
-                except Exception as e:
-                    extracted[u] = f"__error__: {e}"; return
-            txt = await page.evaluate("""
-                () => {
-                    function visible(el) { const s = window.getComputedStyle(el); return s && s.visibility !== 'hidden' && s.display !== 'none'; }
-                    const blocks = []; const w = document.createTreeWalker(document.body, NodeFilter.SHOW_TEXT, null);
-                    let n; while ((n = w.nextNode())) { const t = n.nodeValue.replace(/\\s+/g, ' ').trim(); if (t && visible(n.parentElement)) blocks.push(t); }
-                    const h = [...document.querySelectorAll('h1,h2,h3')].map(e => e.innerText.trim());
-                    return h.join('\\n') + '\\n' + blocks.join('\\n');
-                }
-            """)
-            extracted[u] = txt or ""
-        
-        root = normalize_url(root_url)
-        await visit(root)
-        
+                pass
+        finally:
+            await ctx.close()
+
+    if browser is not None:
+        # Pooled browser owned by the caller (worker runtime); only the context is per-call
+        await scrape_with(browser)
+        return extracted
+
+    async with async_playwright() as p:
+        own_browser = await p.chromium.launch(headless=True)
         try:
-            links = await page.eval_on_selector_all("a[href]", "els => els.map(e => e.href)")
-            links = [normalize_url(l) for l in links if l]
-            links = unique_lines([l for l in links if should_visit(l, root)])
-            for l in links[:MAX_PAGES_PER_DOMAIN-1]:
-                await visit(l)
-        except Exception:
-            pass
-        
-        await browser.close()
-    
+            await scrape_with(own_browser)
+        finally:
+            await own_browser.close()
+
     return extracted
 
 # ---------- Hook extraction ----------
@@ -218,18 +248,34 @@ def pick_evidence(signals: HookSignals, max_items: int = 5) -> List[Tuple[str,st
                 out.append((kind_label, txt))
     return out
 
+def evidence_fingerprint(evidence) -> str:
+    """Stable hash of pick_evidence() output (or its JSON round-trip), insensitive to whitespace noise."""
+    canon = [[str(kind).strip().lower(), re.sub(r"\s+", " ", str(txt)).strip()] for kind, txt in (evidence or [])]
+    return hashlib.sha256(json.dumps(canon, ensure_ascii=False).encode("utf-8")).hexdigest()
+
 
 # ---------- Public API ----------
-async def scrape_and_extract(url: str, firecrawl_base: str, firecrawl_key: str = None, firecrawl_path: str = "/v1/crawl") -> Tuple[Dict[str,str], HookSignals, str]:
+async def scrape_and_extract(
+    url: str,
+    firecrawl_base: str,
+    firecrawl_key: str = None,
+    firecrawl_path: str = "/v1/crawl",
+    http_client: Optional[httpx.AsyncClient] = None,
+    get_browser: Optional[Callable[[], Awaitable[object]]] = None,
+) -> Tuple[Dict[str,str], HookSignals, str]:
     url = normalize_url(url)
     fc = FirecrawlClient(firecrawl_base, firecrawl_key, firecrawl_path)
-    fc_pages = fc.crawl(url, FOLLOW_PATHS)
+    if http_client is not None:
+        fc_pages = await fc.acrawl(http_client, url, FOLLOW_PATHS)
+    else:
+        fc_pages = fc.crawl(url, FOLLOW_PATHS)
     fc_error = fc_pages.get("__error__")
     concat = "\n".join(v for k,v in fc_pages.items() if not k.startswith("__") and v)
     used = "FIRECRAWL_ONLY"
     pages = fc_pages
     if fc_error or looks_thin(concat):
-        pw_pages = await playwright_scrape_bundle(url, FOLLOW_PATHS)
+        browser = await get_browser() if get_browser else None
+        pw_pages = await playwright_scrape_bundle(url, FOLLOW_PATHS, browser=browser)
         if not looks_thin("\n".join(pw_pages.values())):
             pages = pw_pages
             used = "FIRECRAWL_FALLBACK_PLAYWRIGHT"
@@ -1,4 +1,11 @@
 #!/bin/bash
 uvicorn main:app --host 0.0.0.0 --port 8000 &
-celery -A celery_worker.celery_app worker --loglevel=info &
-wait
\ No newline at end of file
+# Celery processes size their DB pools from WORKER_DB_* (see database.py)
+export DB_ROLE=worker
+# Reserved capacity for single-lead requests from the UI
+celery -A celery_worker.celery_app worker --loglevel=info -Q interactive -c ${INTERACTIVE_CONCURRENCY:-2} -n interactive@%h &
+# Bulk coordinators (fan-out, bulk speedtest) and anything left on the default queue
+celery -A celery_worker.celery_app worker --loglevel=info -Q bulk,celery -n bulk@%h &
+celery -A celery_worker.celery_app worker --loglevel=info -Q scrape -c ${SCRAPE_CONCURRENCY:-2} -n scrape@%h &
+celery -A celery_worker.celery_app worker --loglevel=info -Q llm -c ${LLM_CONCURRENCY:-2} -n llm@%h &
+wait
@@ -0,0 +1,24 @@
+import asyncio
+
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+
+from database import Base, LeadDB
+from lead_search import search_leads
+
+
+def test_short_query_treats_wildcards_literally():
+    async def run():
+        engine = create_async_engine("sqlite+aiosqlite://")
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+        async with async_sessionmaker(engine)() as db:
+            db.add_all([LeadDB(email="a_b@example.com"), LeadDB(email="axb@example.com"), LeadDB(email="a%c@example.com")])
+            await db.commit()
+            underscore = [lead.email for lead, _ in await search_leads(db, "a_")]
+            percent = [lead.email for lead, _ in await search_leads(db, "a%")]
+        await engine.dispose()
+        return underscore, percent
+
+    underscore, percent = asyncio.run(run())
+    assert underscore == ["a_b@example.com"]
+    assert percent == ["a%c@example.com"]
@@ -0,0 +1,60 @@
+import time
+
+from punchline_index import PunchlineIndex
+
+TEMPLATE = "Your homepage takes eight seconds to load on mobile devices"
+
+
+def test_clusters_groups_near_duplicates():
+    index = PunchlineIndex(threshold=0.6)
+    index.add((1, 1), TEMPLATE)
+    index.add((2, 1), TEMPLATE + " today")
+    index.add((3, 1), "Completely different line about your checkout flow and cart")
+    index.add((4, 1), "Completely different line about your checkout flow and carts")
+    index.add((5, 1), "Nothing like the others at all here")
+    clusters, complete = index.clusters()
+    assert complete
+    assert sorted(sorted(k for k, _ in c) for c in clusters) == [[(1, 1), (2, 1)], [(3, 1), (4, 1)]]
+
+
+def test_clusters_is_linear_for_one_template():
+    index = PunchlineIndex()
+    for lead_id in range(3000):
+        index.add((lead_id, 1), TEMPLATE)
+    start = time.perf_counter()
+    clusters, complete = index.clusters()
+    assert time.perf_counter() - start < 2
+    assert complete and len(clusters) == 1 and len(clusters[0]) == 3000
+
+
+def test_clusters_stops_at_comparison_cap():
+    index = PunchlineIndex()
+    for lead_id in range(50):
+        index.add((lead_id, 1), f"{TEMPLATE} variant {lead_id} with extra words {lead_id * 3}")
+    _, complete = index.clusters(max_comparisons=5)
+    assert not complete
+
+
+def test_synced_index_picks_up_other_workers_lines(monkeypatch):
+    import datetime
+    import punchline_index
+
+    t0 = datetime.datetime(2026, 1, 1, 12, 0, 0)
+    rows = [(1, [TEMPLATE, None, "FALLBACK"], t0)]
+    seen_since = []
+
+    def fake_rows(batch_size=1000, since=None):
+        seen_since.append(since)
+        return [r for r in rows if since is None or r[2] >= since]
+
+    monkeypatch.setattr(punchline_index, "iter_stored_punchlines", fake_rows)
+    index = punchline_index.build_index_from_db(skip_lines=["fallback"])
+    assert len(index) == 1 and index.synced_until == t0
+
+    # Another worker saves a near-duplicate and regenerates lead 1
+    rows.append((2, [TEMPLATE + " today", None, None], t0 + datetime.timedelta(minutes=1)))
+    rows[0] = (1, ["Something else entirely about your pricing page", None, None], t0 + datetime.timedelta(minutes=2))
+    assert index.sync() == 2
+    assert seen_since[-1] == t0 - datetime.timedelta(seconds=punchline_index.SYNC_OVERLAP_SEC)
+    assert [k for k, _, _ in index.query(TEMPLATE)] == [(2, 1)]
+    assert index.synced_until == t0 + datetime.timedelta(minutes=2)
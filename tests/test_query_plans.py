@@ -0,0 +1,54 @@
+import pytest
+from sqlalchemy import create_engine, select
+
+from database import Base, LeadDB
+
+
+@pytest.fixture(scope="module")
+def engine():
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    with engine.begin() as conn:
+        conn.execute(LeadDB.__table__.insert(), [
+            {
+                "email": f"lead{i}@example.com",
+                "website_url": None if i % 10 == 0 else f"https://example{i}.com",
+                "linkedin_url": f"https://linkedin.com/in/lead{i}",
+                "company": f"Company {i % 50}",
+            }
+            for i in range(2000)
+        ])
+        conn.exec_driver_sql("ANALYZE")
+    yield engine
+    engine.dispose()
+
+
+def plan(engine, query) -> str:
+    sql = str(query.compile(engine, compile_kwargs={"literal_binds": True}))
+    with engine.connect() as conn:
+        return " | ".join(row[-1] for row in conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {sql}"))
+
+
+def test_website_url_lookup_uses_index(engine):
+    assert "ix_leads_website_url" in plan(engine, select(LeadDB).where(LeadDB.website_url == "https://example1.com"))
+
+
+def test_linkedin_url_lookup_uses_index(engine):
+    assert "ix_leads_linkedin_url" in plan(engine, select(LeadDB).where(LeadDB.linkedin_url == "https://linkedin.com/in/lead1"))
+
+
+def test_company_website_lookup_uses_index(engine):
+    query = select(LeadDB).where(LeadDB.company == "Company 1", LeadDB.website_url == "https://example1.com")
+    assert "ix_leads_company_website_url" in plan(engine, query)
+
+
+def test_keyset_page_seeks_instead_of_scanning(engine):
+    # SQLite serves this from the rowid range; ix_leads_listable_id is what Postgres uses
+    query = (
+        select(LeadDB.id)
+        .where(LeadDB.email != None, LeadDB.website_url != None, LeadDB.id > 1500)
+        .order_by(LeadDB.id)
+        .limit(50)
+    )
+    result = plan(engine, query)
+    assert result.startswith("SEARCH leads") and "SCAN" not in result
@@ -0,0 +1,110 @@
+# worker_runtime.py
+import asyncio
+import os
+import threading
+from typing import Optional
+
+import httpx
+from celery.signals import worker_process_init, worker_process_shutdown
+from playwright.async_api import async_playwright
+
+HTTP_MAX_CONNECTIONS = int(os.getenv("WORKER_HTTP_MAX_CONNECTIONS", "20"))
+HTTP_TIMEOUT_SEC = float(os.getenv("WORKER_HTTP_TIMEOUT_SEC", "30"))
+
+
+class AsyncRuntime:
+    """
+    One event loop per worker process, running on a daemon thread.
+    Tasks submit coroutines with run(); the pooled HTTP client and Chromium
+    browser live on that loop and are reused across tasks until shutdown.
+    """
+
+    def __init__(self):
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        self._start_lock = threading.Lock()
+        self._http: Optional[httpx.AsyncClient] = None
+        self._playwright = None
+        self._browser = None
+        self._browser_lock: Optional[asyncio.Lock] = None
+
+    def start(self) -> None:
+        with self._start_lock:
+            if self.loop is not None:
+                return
+            self.loop = asyncio.new_event_loop()
+            self._browser_lock = asyncio.Lock()
+            self._thread = threading.Thread(target=self._run_loop, name="worker-async-runtime", daemon=True)
+            self._thread.start()
+            print(f"[Runtime] Started event loop in worker pid={os.getpid()}")
+
+    def _run_loop(self) -> None:
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def run(self, coro, timeout: Optional[float] = None):
+        """Run a coroutine on the worker loop and block the calling task until it finishes."""
+        if self.loop is None:
+            self.start()  # e.g. the solo pool, which never sends worker_process_init
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result(timeout)
+
+    # --- Pooled resources (only touch these from coroutines running on the loop) ---
+
+    async def get_http_client(self) -> httpx.AsyncClient:
+        if self._http is None or self._http.is_closed:
+            self._http = httpx.AsyncClient(
+                timeout=HTTP_TIMEOUT_SEC,
+                limits=httpx.Limits(max_connections=HTTP_MAX_CONNECTIONS, max_keepalive_connections=HTTP_MAX_CONNECTIONS),
+            )
+        return self._http
+
+    async def get_browser(self):
+        async with self._browser_lock:
+            if self._browser is None or not self._browser.is_connected():
+                if self._playwright is None:
+                    self._playwright = await async_playwright().start()
+                self._browser = await self._playwright.chromium.launch(headless=True)
+                print(f"[Runtime] Launched Chromium in worker pid={os.getpid()}")
+        return self._browser
+
+    async def _aclose(self) -> None:
+        if self._http is not None:
+            await self._http.aclose()
+            self._http = None
+        if self._browser is not None:
+            try:
+                await self._browser.close()
+            except Exception as e:
+                print(f"[Runtime] Error closing browser: {e}")
+            self._browser = None
+        if self._playwright is not None:
+            await self._playwright.stop()
+            self._playwright = None
+
+    def stop(self) -> None:
+        with self._start_lock:
+            if self.loop is None:
+                return
+            try:
+                asyncio.run_coroutine_threadsafe(self._aclose(), self.loop).result(30)
+            except Exception as e:
+                print(f"[Runtime] Error releasing pooled resources: {e}")
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self._thread.join(timeout=10)
+            self.loop.close()
+            self.loop = None
+            self._thread = None
+            print(f"[Runtime] Stopped event loop in worker pid={os.getpid()}")
+
+
+runtime = AsyncRuntime()
+
+
+@worker_process_init.connect
+def _start_runtime(**kwargs):
+    runtime.start()
+
+
+@worker_process_shutdown.connect
+def _stop_runtime(**kwargs):
+    runtime.stop()